@@ -0,0 +1,408 @@
+import heapq
+import math
+import struct
+
+import numpy as np
+
+from .rle import varint_pack, varint_unpack, zigzag_signed, unzigzag_signed
+
+
+HUFFMAN_MAGIC = b"HUF1"
+EXP_GOLOMB_MAGIC = b"EXG1"
+HUFFMAN_HEADER = struct.Struct("<4sQQ")  # magic, symbol count, payload bits
+EXP_GOLOMB_HEADER = struct.Struct("<4sBQQ")  # magic, order, symbol count, payload bits
+MAX_CODE_LENGTH = 16  # same limit as JPEG, keeps the decode lookup table at 64K entries
+MAX_EXP_GOLOMB_ORDER = 31  # leaves room for the sign-mapped value in a 64-bit code
+CHUNK = 1 << 20  # symbols per vectorised pass, bounds the size of the temporaries
+
+# Standard JPEG luminance tables (ITU-T T.81, Annex K.3): code counts per length 1..16 and values
+JPEG_DC_LUMA = (
+    [0, 1, 5, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0],
+    list(range(12)),
+)
+JPEG_AC_LUMA = (
+    [0, 2, 1, 3, 3, 2, 4, 3, 5, 5, 4, 4, 0, 0, 1, 0x7D],
+    [
+        0x01, 0x02, 0x03, 0x00, 0x04, 0x11, 0x05, 0x12, 0x21, 0x31, 0x41, 0x06, 0x13, 0x51, 0x61, 0x07,
+        0x22, 0x71, 0x14, 0x32, 0x81, 0x91, 0xA1, 0x08, 0x23, 0x42, 0xB1, 0xC1, 0x15, 0x52, 0xD1, 0xF0,
+        0x24, 0x33, 0x62, 0x72, 0x82, 0x09, 0x0A, 0x16, 0x17, 0x18, 0x19, 0x1A, 0x25, 0x26, 0x27, 0x28,
+        0x29, 0x2A, 0x34, 0x35, 0x36, 0x37, 0x38, 0x39, 0x3A, 0x43, 0x44, 0x45, 0x46, 0x47, 0x48, 0x49,
+        0x4A, 0x53, 0x54, 0x55, 0x56, 0x57, 0x58, 0x59, 0x5A, 0x63, 0x64, 0x65, 0x66, 0x67, 0x68, 0x69,
+        0x6A, 0x73, 0x74, 0x75, 0x76, 0x77, 0x78, 0x79, 0x7A, 0x83, 0x84, 0x85, 0x86, 0x87, 0x88, 0x89,
+        0x8A, 0x92, 0x93, 0x94, 0x95, 0x96, 0x97, 0x98, 0x99, 0x9A, 0xA2, 0xA3, 0xA4, 0xA5, 0xA6, 0xA7,
+        0xA8, 0xA9, 0xAA, 0xB2, 0xB3, 0xB4, 0xB5, 0xB6, 0xB7, 0xB8, 0xB9, 0xBA, 0xC2, 0xC3, 0xC4, 0xC5,
+        0xC6, 0xC7, 0xC8, 0xC9, 0xCA, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8, 0xD9, 0xDA, 0xE1, 0xE2,
+        0xE3, 0xE4, 0xE5, 0xE6, 0xE7, 0xE8, 0xE9, 0xEA, 0xF1, 0xF2, 0xF3, 0xF4, 0xF5, 0xF6, 0xF7, 0xF8,
+        0xF9, 0xFA,
+    ],
+)
+
+
+class BitWriter:
+    # Collects (code, length) pairs and packs them into 64-bit words when asked
+    def __init__(self):
+        self.codes = []
+        self.lengths = []
+
+    def write(self, codes, lengths):
+        self.codes.append(np.asarray(codes, dtype=np.uint64))
+        self.lengths.append(np.asarray(lengths, dtype=np.uint8))
+
+    def getvalue(self):
+        # Returns (bytes, number of meaningful bits); codes are written MSB first
+        total = sum(int(lengths.sum(dtype=np.int64)) for lengths in self.lengths)
+        words = np.zeros((total >> 6) + 1, dtype=np.uint64)
+        position = 0
+        for all_codes, all_lengths in zip(self.codes, self.lengths):
+            for i in range(0, all_codes.size, CHUNK):
+                codes = all_codes[i:i + CHUNK]
+                ends = position + np.cumsum(all_lengths[i:i + CHUNK], dtype=np.int64)
+                position = int(ends[-1])
+
+                # A code value fits in 64 bits, so it ends in the word holding its last bit
+                # and spills the rest into the word before. Codes are in order, so each
+                # word is the OR of a contiguous run of pieces.
+                word = ends >> 6
+                tail = (ends & 63).astype(np.uint64)
+                low = np.where(tail > 0, codes << ((np.uint64(64) - tail) & np.uint64(63)), np.uint64(0))
+                high = codes >> tail
+                for index, pieces in ((word, low), (np.maximum(word - 1, 0), high)):
+                    first = np.flatnonzero(np.diff(index, prepend=-1))
+                    words[index[first]] |= np.bitwise_or.reduceat(pieces, first)
+        return words.astype(">u8").tobytes()[:(total + 7) // 8], total
+
+
+class BitReader:
+    # Peeks at fields through a big-endian 64-bit window starting at every byte, so a
+    # field of up to 57 bits at any bit position is a single shift away
+    PADDING = 16
+
+    def __init__(self, data, bit_count=None):
+        data = np.frombuffer(data, dtype=np.uint8)
+        self.bit_count = 8 * data.size if bit_count is None else int(bit_count)
+        if self.bit_count > 8 * data.size:
+            raise ValueError("Truncated bit stream")
+
+        padded = np.concatenate((data, np.zeros(self.PADDING, dtype=np.uint8)))
+        windows = np.lib.stride_tricks.sliding_window_view(padded, 8)
+        self.words = np.ascontiguousarray(windows).view(">u8").ravel().astype(np.uint64)
+
+    def peek(self, positions, width):
+        # The `width` (<= 57) bits starting at every position
+        positions = np.asarray(positions, dtype=np.int64)
+        words = self.words[positions >> 3]
+        return (words << (positions & 7).astype(np.uint64)) >> np.uint64(64 - width)
+
+    def read_at(self, starts, lengths):
+        # Read lengths[i] (<= 64) bits at starts[i] for every i, 32 bits at a time
+        starts = np.asarray(starts, dtype=np.int64)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        values = np.zeros(starts.size, dtype=np.uint64)
+        for offset in range(0, int(lengths.max(initial=0)), 32):
+            chunk = np.clip(lengths - offset, 0, 32)
+            active = chunk > 0
+            width = chunk[active].astype(np.uint64)
+            part = self.peek(starts[active] + offset, 32) >> (np.uint64(32) - width)
+            values[active] = (values[active] << width) | part
+        return values
+
+    def leading_zeros(self, positions, limit=64):
+        # Zero bits at every position before the next 1, counted up to `limit`
+        positions = np.asarray(positions, dtype=np.int64)
+        zeros = np.zeros(positions.size, dtype=np.int64)
+        active = np.ones(positions.size, dtype=bool)
+        for offset in range(0, limit, 32):
+            window = self.peek(positions[active] + offset, 32)
+            zeros[active] += 32 - np.frexp(window.astype(np.float64))[1]  # exact below 2^53
+            active[active] = window == 0
+        return np.minimum(zeros, limit)
+
+    def chain(self, jump, count, longest):
+        # Variable-length codes are only self-synchronising from the start of the stream.
+        # The stream is cut into blocks that are all walked at once, code by code: first
+        # from every position a code starting in the `longest` bits before the block can
+        # end at, to learn where the block is left from each of them, then again from the
+        # one entry the blocks before actually lead to.
+        if count == 0:
+            return np.zeros(0, dtype=np.int64)
+        if self.bit_count == 0:
+            raise ValueError("Bit stream ended before all symbols were decoded")
+
+        def step(positions):
+            return np.maximum(jump(positions), 1)
+
+        block = max(4 * longest, -(-self.bit_count // max(4 * math.isqrt(count), 1)))
+        bounds = np.arange(0, self.bit_count, block, dtype=np.int64)
+        stops = np.minimum(bounds + block, self.bit_count)
+
+        before = bounds[1:, None] - np.arange(1, longest + 1)
+        ends = before + step(before.ravel()).reshape(before.shape)
+        entering = ends >= bounds[1:, None]
+        candidates = np.unique(np.stack((
+            np.concatenate(([0], np.nonzero(entering)[0] + 1)),
+            np.concatenate(([0], ends[entering])),
+        ), axis=1), axis=0)
+        exits, codes = self._walk(step, candidates[:, 1], stops[candidates[:, 0]])
+
+        leaving = dict(zip(map(tuple, candidates.tolist()), zip(exits.tolist(), codes.tolist())))
+        entries = np.zeros(bounds.size, dtype=np.int64)
+        counts = np.zeros(bounds.size, dtype=np.int64)
+        for index in range(bounds.size):
+            exit, counts[index] = leaving[index, int(entries[index])]
+            if index + 1 < bounds.size:
+                entries[index + 1] = exit
+
+        offsets = np.cumsum(counts) - counts
+        if counts.sum() < count:
+            raise ValueError("Bit stream ended before all symbols were decoded")
+        needed = offsets < count
+        starts = np.empty(count, dtype=np.int64)
+        self._walk(step, entries[needed], stops[needed], starts, offsets[needed])
+        return starts
+
+    @staticmethod
+    def _walk(step, positions, stops, out=None, offsets=None):
+        # Walk every position code by code up to its stop; returns where each walk ended
+        # and how many codes it went through. With `out`, the code starts of walk i are
+        # stored from out[offsets[i]] on (up to the end of `out`).
+        positions = positions.copy()
+        codes = np.zeros(positions.size, dtype=np.int64)
+        active = np.flatnonzero(positions < stops)
+        while active.size:
+            if out is not None:
+                active = active[offsets[active] + codes[active] < out.size]
+                out[offsets[active] + codes[active]] = positions[active]
+            positions[active] += step(positions[active])
+            codes[active] += 1
+            active = active[positions[active] < stops[active]]
+        return positions, codes
+
+
+class HuffmanTable:
+    def __init__(self, symbols, lengths):
+        # symbols are given in canonical order: by code length, then by position
+        self.symbols = np.asarray(symbols, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        if self.lengths.size and self.lengths.max() > MAX_CODE_LENGTH:
+            raise ValueError(f"Code lengths above {MAX_CODE_LENGTH} bits are not supported")
+        if self.lengths.size and (self.lengths.min() < 1 or np.any(np.diff(self.lengths) < 0)):
+            raise ValueError("Code lengths must be positive and in canonical order")
+        if np.sum(2.0 ** -self.lengths) > 1:
+            raise ValueError("Code lengths do not form a prefix code")
+
+        codes = np.zeros(self.symbols.size, dtype=np.uint64)
+        code = 0
+        previous = 0
+        for i, length in enumerate(self.lengths.tolist()):
+            code <<= length - previous
+            codes[i] = code
+            code += 1
+            previous = length
+        self.codes = codes
+
+        self.sort_order = np.argsort(self.symbols, kind="stable")
+        self.sorted_symbols = self.symbols[self.sort_order]
+
+    @classmethod
+    def from_frequencies(cls, values):
+        symbols, counts = np.unique(np.asarray(values, dtype=np.int64), return_counts=True)
+        if symbols.size == 0:
+            return cls([], [])
+        if symbols.size == 1:
+            return cls(symbols, [1])
+
+        if symbols.size > 1 << MAX_CODE_LENGTH:
+            raise ValueError(f"{symbols.size} distinct values do not fit in {MAX_CODE_LENGTH}-bit Huffman codes")
+
+        lengths = cls._code_lengths(counts)
+        if lengths.max() > MAX_CODE_LENGTH:
+            lengths = cls._limit_lengths(lengths, counts)
+
+        order = np.lexsort((symbols, lengths))
+        return cls(symbols[order], lengths[order])
+
+    @classmethod
+    def from_jpeg(cls, spec):
+        bits, values = spec
+        lengths = np.repeat(np.arange(1, len(bits) + 1), bits)
+        return cls(values, lengths)
+
+    @staticmethod
+    def _code_lengths(counts):
+        lengths = np.zeros(counts.size, dtype=np.int64)
+        heap = [(int(count), i, [i]) for i, count in enumerate(counts)]
+        heapq.heapify(heap)
+        while len(heap) > 1:
+            count_a, tie, members_a = heapq.heappop(heap)
+            count_b, _, members_b = heapq.heappop(heap)
+            merged = members_a + members_b
+            lengths[merged] += 1
+            heapq.heappush(heap, (count_a + count_b, tie, merged))
+        return lengths
+
+    @staticmethod
+    def _limit_lengths(lengths, counts):
+        # Adjust_BITS from JPEG (ITU-T T.81, Annex K.3): take two codes from the longest
+        # length, give their prefix to one of them and turn the other into a sibling of a
+        # shorter code, until no code is longer than the limit. The code lengths are then
+        # handed out again, shortest first, in the original order of the symbols.
+        bits = np.bincount(lengths).tolist()
+        for i in range(len(bits) - 1, MAX_CODE_LENGTH, -1):
+            while bits[i] > 0:
+                j = i - 2
+                while bits[j] == 0:
+                    j -= 1
+                bits[i] -= 2
+                bits[i - 1] += 1
+                bits[j + 1] += 2
+                bits[j] -= 1
+
+        limited = np.empty_like(lengths)
+        limited[np.lexsort((-counts, lengths))] = np.repeat(np.arange(len(bits)), bits)
+        return limited
+
+    def encode(self, values, writer: BitWriter):
+        values = np.asarray(values, dtype=np.int64)
+        if values.size and self.sorted_symbols.size == 0:
+            raise ValueError("Some values have no code in this Huffman table")
+        for i in range(0, values.size, CHUNK):
+            chunk = values[i:i + CHUNK]
+            index = np.minimum(np.searchsorted(self.sorted_symbols, chunk), self.sorted_symbols.size - 1)
+            if np.any(self.sorted_symbols[index] != chunk):
+                raise ValueError("Some values have no code in this Huffman table")
+            canonical = self.sort_order[index]
+            writer.write(self.codes[canonical], self.lengths[canonical])
+
+    def decode(self, reader: BitReader, count):
+        if count == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        # Lookup table indexed by the next max_length bits: every code fills the range of
+        # windows that start with it, and canonical codes fill them in order
+        max_length = int(self.lengths.max())
+        spans = 1 << (max_length - self.lengths)
+        table_symbol = np.full(1 << max_length, -1, dtype=np.int64)
+        table_length = np.zeros(1 << max_length, dtype=np.int64)
+        table_symbol[:spans.sum()] = np.repeat(np.arange(self.symbols.size), spans)
+        table_length[:spans.sum()] = np.repeat(self.lengths, spans)
+
+        starts = reader.chain(lambda positions: table_length[reader.peek(positions, max_length)], count, max_length)
+        values = np.empty(count, dtype=np.int64)
+        for i in range(0, count, CHUNK):
+            found = table_symbol[reader.peek(starts[i:i + CHUNK], max_length)]
+            if np.any(found < 0):
+                raise ValueError("Invalid Huffman code in bit stream")
+            values[i:i + CHUNK] = self.symbols[found]
+        if starts[-1] + self.lengths[found[-1]] > reader.bit_count:
+            raise ValueError("Bit stream ended before all symbols were decoded")
+        return values
+
+
+def bit_length(values):
+    # Exact bit length of every uint64: float64 may round values above 2^53 up to the
+    # next power of two, which the integer shift check then takes back
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.minimum(np.frexp(values.astype(np.float64))[1], 64).astype(np.int64)
+    rounded_up = (values >> np.maximum(lengths - 1, 0).astype(np.uint64)) == 0
+    return lengths - (rounded_up & (values > 0))
+
+
+def exp_golomb_codes(values, order=0):
+    # Signed Exp-Golomb (H.264 se(v) mapping): 0, 1, -1, 2, -2, ... -> 0, 1, 2, 3, 4, ...
+    # computed in uint64, where the magnitude of -2^63 still fits
+    values = np.asarray(values, dtype=np.int64)
+    positive = values > 0
+    magnitude = np.where(positive, values, 0).astype(np.uint64) | (np.uint64(0) - np.minimum(values, 0).view(np.uint64))
+
+    # The code value (mapped + 2^order) has to fit in 64 bits
+    largest = (1 << 64) - 1 - (1 << order)
+    too_large = np.where(positive, magnitude > np.uint64((largest + 1) // 2), magnitude > np.uint64(largest // 2))
+    if np.any(too_large):
+        raise ValueError(f"{values[too_large][0]} does not fit in a 64-bit order-{order} Exp-Golomb code")
+
+    mapped = 2 * magnitude - positive.astype(np.uint64)
+    shifted = mapped + np.uint64(1 << order)
+    return shifted, 2 * bit_length(shifted) - 1 - order
+
+
+def huffman_encode(values, table: HuffmanTable = None):
+    values = np.asarray(values, dtype=np.int64).ravel()
+    table = table or HuffmanTable.from_frequencies(values)
+
+    writer = BitWriter()
+    table.encode(values, writer)
+    payload, bit_count = writer.getvalue()
+
+    # The canonical table travels with the stream: symbols then their code lengths
+    table_bytes = (
+        varint_pack([table.symbols.size])
+        + varint_pack(zigzag_signed(table.symbols))
+        + table.lengths.astype(np.uint8).tobytes()
+    )
+    return HUFFMAN_HEADER.pack(HUFFMAN_MAGIC, values.size, bit_count) + table_bytes + payload
+
+
+def huffman_decode(data):
+    magic, count, bit_count = HUFFMAN_HEADER.unpack_from(data)
+    if magic != HUFFMAN_MAGIC:
+        raise ValueError("Not a Huffman stream")
+
+    body = memoryview(data)[HUFFMAN_HEADER.size:]
+    symbol_count = int(varint_unpack(body, 1)[0])
+    header_numbers = varint_unpack(body, 1 + symbol_count)
+    symbols = unzigzag_signed(header_numbers[1:])
+    offset = len(varint_pack(header_numbers))
+    lengths = np.frombuffer(body[offset:offset + symbol_count], dtype=np.uint8)
+
+    table = HuffmanTable(symbols, lengths)
+    reader = BitReader(body[offset + symbol_count:], bit_count)
+    return table.decode(reader, count)
+
+
+def exp_golomb_encode(values, order=0):
+    if not 0 <= order <= MAX_EXP_GOLOMB_ORDER:
+        raise ValueError(f"Exp-Golomb order must be between 0 and {MAX_EXP_GOLOMB_ORDER}")
+    values = np.asarray(values, dtype=np.int64).ravel()
+    writer = BitWriter()
+    for i in range(0, values.size, CHUNK):
+        writer.write(*exp_golomb_codes(values[i:i + CHUNK], order))
+    payload, bit_count = writer.getvalue()
+    return EXP_GOLOMB_HEADER.pack(EXP_GOLOMB_MAGIC, order, values.size, bit_count) + payload
+
+
+def exp_golomb_decode(data):
+    magic, order, count, bit_count = EXP_GOLOMB_HEADER.unpack_from(data)
+    if magic != EXP_GOLOMB_MAGIC:
+        raise ValueError("Not an Exp-Golomb stream")
+    if order > MAX_EXP_GOLOMB_ORDER:
+        raise ValueError(f"Exp-Golomb order {order} is above {MAX_EXP_GOLOMB_ORDER}")
+
+    reader = BitReader(memoryview(data)[EXP_GOLOMB_HEADER.size:], bit_count)
+    if count == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # A code is z leading zeros followed by the (z + 1 + order)-bit value
+    starts = reader.chain(lambda positions: 2 * reader.leading_zeros(positions) + 1 + order, count, 129 + order)
+    values = np.empty(count, dtype=np.int64)
+    for i in range(0, count, CHUNK):
+        chunk = starts[i:i + CHUNK]
+        prefix = reader.leading_zeros(chunk)
+        if np.any(prefix + 1 + order > 64) or np.any(chunk + 2 * prefix + 1 + order > reader.bit_count):
+            raise ValueError("Invalid Exp-Golomb code in bit stream")
+        shifted = reader.read_at(chunk + prefix, prefix + 1 + order)
+
+        # Back from the unsigned mapping without leaving uint64: odd -> positive, even -> negative
+        mapped = shifted - np.uint64(1 << order)
+        half = mapped >> np.uint64(1)
+        odd = (mapped & np.uint64(1)).astype(bool)
+        values[i:i + CHUNK] = np.where(odd, half + np.uint64(1), np.uint64(0) - half).view(np.int64)
+    return values
+
+
+def decode_stream(data):
+    magic = bytes(data[:4])
+    if magic == HUFFMAN_MAGIC:
+        return huffman_decode(data)
+    if magic == EXP_GOLOMB_MAGIC:
+        return exp_golomb_decode(data)
+    raise ValueError("Unknown entropy-coded stream")
@@ -0,0 +1,240 @@
+import threading
+from fractions import Fraction
+from typing import NamedTuple
+
+import ffmpeg
+import numpy as np
+
+
+# Same codec -> (encoder, container) map as the /convert/ endpoint in practice2
+supported_codecs = {
+    "vp8": ("libvpx", "webm"),
+    "vp9": ("libvpx-vp9", "webm"),
+    "h265": ("libx265", "mp4"),
+    "av1": ("libaom-av1", "mp4"),
+}
+
+
+def plane_shapes(pix_fmt, width, height):
+    # Layout of one raw frame, plane by plane, as ffmpeg writes it for rawvideo
+    chroma = ((height + 1) // 2, (width + 1) // 2)
+    if pix_fmt == "yuv420p":
+        return [(height, width), chroma, chroma]
+    if pix_fmt == "yuv444p":
+        return [(height, width)] * 3
+    if pix_fmt == "gray":
+        return [(height, width)]
+    if pix_fmt == "rgb24":
+        return [(height, width, 3)]
+    raise ValueError(f"Unsupported pixel format: {pix_fmt}")
+
+
+def parse_frame_rate(value):
+    try:
+        return float(Fraction(value))
+    except (ValueError, ZeroDivisionError, TypeError):
+        return 0.0
+
+
+def split_planes(buffer, shapes):
+    planes = []
+    offset = 0
+    for shape in shapes:
+        size = int(np.prod(shape))
+        planes.append(buffer[offset:offset + size].reshape(shape))
+        offset += size
+    return tuple(planes)
+
+
+def stderr_drain(process):
+    # Keep ffmpeg's stderr flowing so it never blocks, and keep it for error messages
+    lines = []
+    thread = threading.Thread(target=lambda: lines.extend(process.stderr), daemon=True)
+    thread.start()
+    return thread, lines
+
+
+class Frame(NamedTuple):
+    index: int
+    time: float
+    planes: tuple
+    buffer: np.ndarray
+
+
+class FrameReader:
+    # Decodes a video into raw frames on a pipe and reads them straight into a ring of
+    # preallocated buffers. Yielded frames are views into that ring and get overwritten
+    # `ring_size` frames later, so copy anything that has to live longer.
+    def __init__(self, path, pix_fmt="yuv420p", start=0.0, start_frame=None, max_frames=None,
+                 ring_size=4, width=None, height=None, fps=None):
+        if width is None or height is None or fps is None:
+            probe = ffmpeg.probe(path)
+            video = next((stream for stream in probe["streams"] if stream.get("codec_type") == "video"), None)
+            if video is None:
+                raise ValueError("Input has no video stream")
+            width = width or int(video["width"])
+            height = height or int(video["height"])
+            fps = fps or parse_frame_rate(video.get("avg_frame_rate")) or parse_frame_rate(video.get("r_frame_rate"))
+
+        if start_frame is not None:
+            if not fps:
+                raise ValueError("Seeking by frame needs a known frame rate")
+            start = start_frame / fps
+
+        self.path = path
+        self.pix_fmt = pix_fmt
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.start = start
+        self.max_frames = max_frames
+        self.first_index = start_frame if start_frame is not None else round(start * fps) if fps else 0
+
+        self.shapes = plane_shapes(pix_fmt, width, height)
+        self.frame_size = sum(int(np.prod(shape)) for shape in self.shapes)
+        self.ring = np.empty((max(ring_size, 1), self.frame_size), dtype=np.uint8)
+        self.slots = [(buffer, split_planes(buffer, self.shapes)) for buffer in self.ring]
+
+    def command(self):
+        # Input-side -ss seeks to the keyframe before `start` and decodes forward to it
+        stream = ffmpeg.input(self.path, ss=self.start) if self.start else ffmpeg.input(self.path)
+        output_args = {"format": "rawvideo", "pix_fmt": self.pix_fmt}
+        if self.max_frames is not None:
+            output_args["frames:v"] = self.max_frames
+        return stream.video.output("pipe:", **output_args).global_args("-loglevel", "error", "-nostdin")
+
+    def fill(self, stream, buffer):
+        view = memoryview(buffer)
+        filled = 0
+        while filled < self.frame_size:
+            count = stream.readinto(view[filled:])
+            if not count:
+                break
+            filled += count
+        if filled and filled < self.frame_size:
+            raise ValueError(f"Truncated frame: got {filled} of {self.frame_size} bytes")
+        return filled == self.frame_size
+
+    def __iter__(self):
+        process = self.command().run_async(pipe_stdout=True, pipe_stderr=True)
+        stderr_thread, stderr_lines = stderr_drain(process)
+
+        finished = False
+        try:
+            position = 0
+            while True:
+                buffer, planes = self.slots[position % len(self.slots)]
+                if not self.fill(process.stdout, buffer):
+                    break
+                index = self.first_index + position
+                yield Frame(index, index / self.fps if self.fps else 0.0, planes, buffer)
+                position += 1
+            finished = True
+        finally:
+            # Stopping early (break, exception) must not leave the decoder running
+            if not finished:
+                process.kill()
+            process.stdout.close()
+            returncode = process.wait()
+            stderr_thread.join()
+
+        if returncode != 0:
+            raise ffmpeg.Error("ffmpeg", b"", b"".join(stderr_lines))
+
+    def read(self):
+        # First frame of the selection, copied out of the ring
+        frames = iter(self)
+        try:
+            frame = next(frames, None)
+        finally:
+            frames.close()
+        if frame is None:
+            return None
+        buffer = frame.buffer.copy()
+        return frame._replace(buffer=buffer, planes=split_planes(buffer, self.shapes))
+
+
+def frame_to_yuv(frame, pix_fmt="yuv420p"):
+    # HxWx3 YUV image from a frame's planes, upsampling 4:2:0 chroma by repetition
+    if pix_fmt not in ("yuv420p", "yuv444p"):
+        raise ValueError(f"Expected a YUV frame, got {pix_fmt}")
+    luma, u, v = frame.planes
+    height, width = luma.shape
+    if pix_fmt == "yuv420p":
+        u, v = (plane.repeat(2, axis=0).repeat(2, axis=1)[:height, :width] for plane in (u, v))
+    return np.stack((luma, u, v), axis=-1)
+
+
+class FrameWriter:
+    # Keeps one encoder process open and feeds it raw frames on stdin. Writes go
+    # straight from the caller's arrays to the pipe and block while the encoder is
+    # busy, so a slow encoder throttles the producer instead of frames piling up.
+    def __init__(self, path, width, height, codec="vp9", fps=25, pix_fmt="yuv420p", **output_args):
+        if codec.lower() not in supported_codecs:
+            raise ValueError(f"Unsupported codec: {codec}")
+        codec_name, container = supported_codecs[codec.lower()]
+
+        self.path = path
+        self.container = container
+        self.shapes = plane_shapes(pix_fmt, width, height)
+        self.frame_size = sum(int(np.prod(shape)) for shape in self.shapes)
+        self.frames_written = 0
+
+        stream = ffmpeg.input("pipe:", format="rawvideo", pix_fmt=pix_fmt, s=f"{width}x{height}", framerate=fps).output(
+            path, vcodec=codec_name, pix_fmt="yuv420p", format=container, **output_args
+        ).overwrite_output().global_args("-loglevel", "error")
+        self.process = stream.run_async(pipe_stdin=True, pipe_stderr=True)
+        self.stderr_thread, self.stderr_lines = stderr_drain(self.process)
+
+    def write(self, frame):
+        # Accepts a Frame, a tuple of planes or one array holding the whole raw frame
+        if isinstance(frame, Frame):
+            planes = frame.planes
+        elif isinstance(frame, (tuple, list)):
+            planes = frame
+        else:
+            planes = (frame,)
+
+        planes = [np.ascontiguousarray(plane) for plane in planes]
+        if any(plane.dtype != np.uint8 for plane in planes):
+            raise ValueError("Frames must be uint8")
+        size = sum(plane.size for plane in planes)
+        if size != self.frame_size:
+            raise ValueError(f"Expected {self.frame_size} bytes per frame, got {size}")
+
+        try:
+            for plane in planes:
+                self.process.stdin.write(plane.data)
+        except BrokenPipeError:
+            # The encoder exited early; close() reports why
+            self.close()
+        self.frames_written += 1
+
+    def close(self):
+        if self.process.stdin.closed:
+            return self.path
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self.process.wait()
+        self.stderr_thread.join()
+        if returncode != 0:
+            raise ffmpeg.Error("ffmpeg", b"", b"".join(self.stderr_lines))
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+            return
+        # Abandon the output on errors without masking the original exception
+        self.process.kill()
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.process.wait()
+        self.stderr_thread.join()
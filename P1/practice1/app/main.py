@@ -1,14 +1,38 @@
 from typing import Union
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+import io
 import os
+import tempfile
+import struct
+import time
+import json
 import ffmpeg
 from PIL import Image
 import numpy as np
 from numpy import random
-from scipy.fft import dct, idct
+from scipy.fft import dctn, idctn
 import pywt
 from pydantic import BaseModel
-from typing import List
+from typing import List, NamedTuple
+
+from .zigzag import zigzag_scan, inverse_zigzag_scan
+from .wavelet import WaveletEngine
+from .frames import FrameReader, FrameWriter, frame_to_yuv, supported_codecs
+from .rle import rle_encode, rle_encode_many, rle_decode, rle_to_bytes, rle_from_bytes
+from .entropy import (
+    HuffmanTable,
+    JPEG_AC_LUMA,
+    JPEG_DC_LUMA,
+    MAX_EXP_GOLOMB_ORDER,
+    decode_stream,
+    exp_golomb_decode,
+    exp_golomb_encode,
+    huffman_decode,
+    huffman_encode,
+)
 
 
 class Translator:
@@ -45,34 +69,9 @@ class Translator:
     # Task 4: Serpentine matrix traversal
     @staticmethod
     def serpentine(matrix, N, M):
-        i, j = 1, 1
-        up = False
-        result = []
-
-        while i <= N and j <= M:
-            result.append(matrix[i - 1][j - 1])
-            
-            if i == N:  # Reached the last row
-                j += 1
-                up = True
-            elif j == M:  # Reached the last column
-                i += 1
-                up = False
-            elif i == 1:  # Reached the first row
-                j += 1
-                up = False
-            elif j == 1:  # Reached the first column
-                i += 1
-                up = True
-            else:  # General traversal
-                if up:
-                    i -= 1
-                    j += 1
-                else:
-                    i += 1
-                    j -= 1
-
-        return result
+        if N == 0 or M == 0:
+            return []
+        return zigzag_scan(np.asarray(matrix).reshape(N, M)).tolist()
 
     # Task 5: Color to Black and White
     @staticmethod
@@ -89,32 +88,208 @@ class Translator:
     # Task 5: Run-Length Encoding
     @staticmethod
     def run_length_encoding(serie):
-        if not serie:
+        if len(serie) == 0:
             return []
 
-        encoded_serie = []
-        current_value = serie[0]
-        count = 1
-
-        for i in range(1, len(serie)):
-            if serie[i] == current_value:
-                count += 1
-            else:
-                encoded_serie.append([current_value, count])
-                current_value = serie[i]
-                count = 1
-
-        # Append the final segment
-        encoded_serie.append([current_value, count])
-
-        return encoded_serie
+        values, lengths = rle_encode(serie)
+        return np.column_stack((values, lengths)).tolist()
 
 class DCTConverter:
+    # Transforms the last two axes, so a stack of matrices goes through in one call
     def encode(self, a):
-        return dct(dct(a.T, norm="ortho").T, norm="ortho")
-    
+        return dctn(a, axes=(-2, -1), norm="ortho")
+
     def decode(self, a):
-        return idct(idct(a.T, norm="ortho").T, norm="ortho")
+        return idctn(a, axes=(-2, -1), norm="ortho")
+
+
+class BlockDCTConverter:
+    # JPEG quantization tables for quality 50 (ITU-T T.81, Annex K)
+    LUMA_TABLE = np.array([
+        [16, 11, 10, 16, 24, 40, 51, 61],
+        [12, 12, 14, 19, 26, 58, 60, 55],
+        [14, 13, 16, 24, 40, 57, 69, 56],
+        [14, 17, 22, 29, 51, 87, 80, 62],
+        [18, 22, 37, 56, 68, 109, 103, 77],
+        [24, 35, 55, 64, 81, 104, 113, 92],
+        [49, 64, 78, 87, 103, 121, 120, 101],
+        [72, 92, 95, 98, 112, 100, 103, 99],
+    ])
+    CHROMA_TABLE = np.array([
+        [17, 18, 24, 47, 99, 99, 99, 99],
+        [18, 21, 26, 66, 99, 99, 99, 99],
+        [24, 26, 56, 99, 99, 99, 99, 99],
+        [47, 66, 99, 99, 99, 99, 99, 99],
+        [99, 99, 99, 99, 99, 99, 99, 99],
+        [99, 99, 99, 99, 99, 99, 99, 99],
+        [99, 99, 99, 99, 99, 99, 99, 99],
+        [99, 99, 99, 99, 99, 99, 99, 99],
+    ])
+
+    def __init__(self, block_size=8, quality=50, chroma=False):
+        self.block_size = block_size
+        self.table = self.quantization_table(quality, block_size, chroma)
+
+    @staticmethod
+    def quantization_table(quality=50, block_size=8, chroma=False):
+        # IJG quality scaling; other block sizes stretch the 8x8 table over the block
+        quality = min(max(int(quality), 1), 100)
+        scale = 5000 / quality if quality < 50 else 200 - 2 * quality
+        base = BlockDCTConverter.CHROMA_TABLE if chroma else BlockDCTConverter.LUMA_TABLE
+        table = np.clip(np.floor((base * scale + 50) / 100), 1, 255)
+        if block_size != 8:
+            index = np.arange(block_size) * 8 // block_size
+            table = table[np.ix_(index, index)]
+        return table.astype(np.float32)
+
+    def split_blocks(self, plane):
+        # Pad to a whole number of blocks, then view the plane as (rows, cols, b, b)
+        b = self.block_size
+        height, width = plane.shape
+        padded = np.pad(plane, ((0, -height % b), (0, -width % b)), mode="edge")
+        rows, cols = padded.shape[0] // b, padded.shape[1] // b
+        return padded.reshape(rows, b, cols, b).swapaxes(1, 2)
+
+    @staticmethod
+    def merge_blocks(blocks, height, width):
+        rows, cols, b, _ = blocks.shape
+        return blocks.swapaxes(1, 2).reshape(rows * b, cols * b)[:height, :width]
+
+    def encode(self, plane, quantize=True):
+        # Level shift and transform every block in one batched call
+        blocks = self.split_blocks(np.asarray(plane, dtype=np.float32) - 128)
+        coefficients = dctn(blocks, axes=(-2, -1), norm="ortho")
+        if not quantize:
+            return coefficients
+        return np.rint(coefficients / self.table).astype(np.int32)
+
+    def decode(self, coefficients, height, width, quantized=True):
+        coefficients = np.asarray(coefficients, dtype=np.float32)
+        if quantized:
+            coefficients = coefficients * self.table
+        blocks = idctn(coefficients, axes=(-2, -1), norm="ortho")
+        plane = self.merge_blocks(blocks, height, width) + 128
+        return np.clip(np.rint(plane), 0, 255).astype(np.uint8)
+
+
+class ImageCodec:
+    # Intra-frame codec built from the toolkit: YUV conversion, optional 4:2:0
+    # subsampling, 8x8 DCT + quantization, zigzag, DC prediction, run-length
+    # coding, and Huffman (values) / Exp-Golomb (run lengths) entropy coding
+    MAGIC = b"IMC1"
+    HEADER = struct.Struct("<4sIIBB")  # magic, width, height, quality, 4:2:0 flag
+    PLANE_HEADER = struct.Struct("<II")  # sizes of the value and run-length streams
+    BLOCK_SIZE = 8
+
+    def __init__(self, quality=75, subsample=True, standard="bt601"):
+        self.quality = min(max(int(quality), 1), 100)
+        self.subsample = subsample
+        self.colors = ColorConverter(standard)
+
+    @staticmethod
+    def downsample(plane):
+        height, width = plane.shape
+        padded = np.pad(plane, ((0, height % 2), (0, width % 2)), mode="edge").astype(np.float32)
+        halves = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2)
+        return np.rint(halves.mean(axis=(1, 3))).astype(np.uint8)
+
+    @staticmethod
+    def upsample(plane, height, width):
+        return plane.repeat(2, axis=0).repeat(2, axis=1)[:height, :width]
+
+    def plane_shapes(self, height, width, subsample):
+        chroma = ((height + 1) // 2, (width + 1) // 2) if subsample else (height, width)
+        return [(height, width), chroma, chroma]
+
+    def encode(self, image):
+        timings = {}
+        height, width = image.shape[:2]
+
+        start = time.perf_counter()
+        yuv = self.colors.rgb_to_yuv(image)
+        timings["color"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        planes = [yuv[..., 0], yuv[..., 1], yuv[..., 2]]
+        if self.subsample:
+            planes[1:] = [self.downsample(plane) for plane in planes[1:]]
+        timings["subsample"] = time.perf_counter() - start
+
+        streams = []
+        for i, plane in enumerate(planes):
+            start = time.perf_counter()
+            coefficients = BlockDCTConverter(self.BLOCK_SIZE, self.quality, chroma=i > 0).encode(plane)
+            timings["dct"] = timings.get("dct", 0) + time.perf_counter() - start
+
+            start = time.perf_counter()
+            scanned = zigzag_scan(coefficients).reshape(-1, self.BLOCK_SIZE * self.BLOCK_SIZE)
+            scanned[:, 0] = np.diff(scanned[:, 0], prepend=0)  # DC is coded as the change from the previous block
+            timings["zigzag"] = timings.get("zigzag", 0) + time.perf_counter() - start
+
+            start = time.perf_counter()
+            values, lengths = rle_encode(scanned)
+            timings["rle"] = timings.get("rle", 0) + time.perf_counter() - start
+
+            start = time.perf_counter()
+            value_stream = huffman_encode(values)
+            length_stream = exp_golomb_encode(lengths - 1)
+            streams.append(self.PLANE_HEADER.pack(len(value_stream), len(length_stream)) + value_stream + length_stream)
+            timings["entropy"] = timings.get("entropy", 0) + time.perf_counter() - start
+
+        header = self.HEADER.pack(self.MAGIC, width, height, self.quality, int(self.subsample))
+        return header + b"".join(streams), timings
+
+    def decode(self, data):
+        timings = {}
+        magic, width, height, quality, subsample = self.HEADER.unpack_from(data)
+        if magic != self.MAGIC:
+            raise ValueError("Not an image codec bitstream")
+
+        offset = self.HEADER.size
+        planes = []
+        for i, (plane_height, plane_width) in enumerate(self.plane_shapes(height, width, subsample)):
+            value_size, length_size = self.PLANE_HEADER.unpack_from(data, offset)
+            offset += self.PLANE_HEADER.size
+
+            start = time.perf_counter()
+            values = huffman_decode(data[offset:offset + value_size])
+            lengths = exp_golomb_decode(data[offset + value_size:offset + value_size + length_size]) + 1
+            offset += value_size + length_size
+            timings["entropy"] = timings.get("entropy", 0) + time.perf_counter() - start
+
+            start = time.perf_counter()
+            rows = -(-plane_height // self.BLOCK_SIZE)
+            cols = -(-plane_width // self.BLOCK_SIZE)
+            scanned = rle_decode(values, lengths)
+            if scanned.size != rows * cols * self.BLOCK_SIZE * self.BLOCK_SIZE:
+                raise ValueError("Corrupt plane: unexpected number of coefficients")
+            timings["rle"] = timings.get("rle", 0) + time.perf_counter() - start
+
+            start = time.perf_counter()
+            scanned = scanned.reshape(rows * cols, -1)
+            scanned[:, 0] = np.cumsum(scanned[:, 0])
+            coefficients = inverse_zigzag_scan(scanned.reshape(rows, cols, -1), self.BLOCK_SIZE, self.BLOCK_SIZE)
+            timings["zigzag"] = timings.get("zigzag", 0) + time.perf_counter() - start
+
+            start = time.perf_counter()
+            converter = BlockDCTConverter(self.BLOCK_SIZE, quality, chroma=i > 0)
+            planes.append(converter.decode(coefficients, plane_height, plane_width))
+            timings["dct"] = timings.get("dct", 0) + time.perf_counter() - start
+
+        start = time.perf_counter()
+        if subsample:
+            planes[1:] = [self.upsample(plane, height, width) for plane in planes[1:]]
+        timings["subsample"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        image = self.colors.yuv_to_rgb(np.stack(planes, axis=-1))
+        timings["color"] = time.perf_counter() - start
+        return image, timings
+
+    @staticmethod
+    def psnr(original, decoded):
+        mse = np.mean((original.astype(np.float64) - decoded.astype(np.float64)) ** 2)
+        return float("inf") if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
 
 
 class DWTConverter:
@@ -123,6 +298,61 @@ class DWTConverter:
         return coeffs
 
 
+class ColorConverter:
+    # Full-range (JPEG) conversion matrices; U and V are offset by 128
+    MATRICES = {
+        "bt601": np.array([
+            [0.299, 0.587, 0.114],
+            [-0.168736, -0.331264, 0.5],
+            [0.5, -0.418688, -0.081312],
+        ]),
+        "bt709": np.array([
+            [0.2126, 0.7152, 0.0722],
+            [-0.114572, -0.385428, 0.5],
+            [0.5, -0.454153, -0.045847],
+        ]),
+    }
+    OFFSET = np.array([0.0, 128.0, 128.0], dtype=np.float32)
+
+    def __init__(self, standard="bt601"):
+        if standard not in self.MATRICES:
+            raise ValueError(f"Unknown standard: {standard}")
+        self.forward = self.MATRICES[standard].T.astype(np.float32)
+        self.inverse = np.linalg.inv(self.MATRICES[standard]).T.astype(np.float32)
+
+    @staticmethod
+    def _to_uint8(result, out=None):
+        np.rint(result, out=result)
+        np.clip(result, 0, 255, out=result)
+        if out is None:
+            return result.astype(np.uint8)
+        np.copyto(out, result, casting="unsafe")
+        return out
+
+    # Works on any array whose last axis holds the 3 channels: HxWx3 images or NxHxWx3 batches
+    def rgb_to_yuv(self, rgb, out=None):
+        result = np.matmul(np.asarray(rgb, dtype=np.float32), self.forward)
+        result += self.OFFSET
+        return self._to_uint8(result, out)
+
+    def yuv_to_rgb(self, yuv, out=None):
+        result = np.asarray(yuv, dtype=np.float32) - self.OFFSET
+        np.matmul(result, self.inverse, out=result)
+        return self._to_uint8(result, out)
+
+    # Planar buffers store the three planes one after the other (3xHxW)
+    @staticmethod
+    def from_planar(buffer, width, height):
+        planes = np.frombuffer(buffer, dtype=np.uint8)
+        if planes.size != 3 * width * height:
+            raise ValueError(f"Expected {3 * width * height} bytes for a {width}x{height} planar frame, got {planes.size}")
+        return np.moveaxis(planes.reshape(3, height, width), 0, -1)
+
+    @staticmethod
+    def to_planar(image):
+        return np.ascontiguousarray(np.moveaxis(image, -1, 0)).tobytes()
+
+
 # Models for API inputs and outputs
 class RGBInput(BaseModel):
     R: float
@@ -140,12 +370,22 @@ class SerpentineInput(BaseModel):
 class RLEncodingInput(BaseModel):
     serie: List[int]
 
+class EntropyInput(BaseModel):
+    serie: List[int]
+
 class MatrixInput(BaseModel):
     matrix: List[List[float]]
 
 class DWTInput(BaseModel):
     data: List[float]
 
+class BatchItem(BaseModel):
+    op: str
+    input: dict
+
+class BatchInput(BaseModel):
+    operations: List[BatchItem]
+
 
 app = FastAPI()
 
@@ -167,6 +407,120 @@ def yuv_to_rgb(input_data: YUVInput):
     return {"R": R, "G": G, "B": B}
 
 
+def planar_response(image, format_name):
+    height, width = image.shape[:2]
+    return Response(
+        content=ColorConverter.to_planar(image),
+        media_type="application/octet-stream",
+        headers={"X-Width": str(width), "X-Height": str(height), "X-Pixel-Format": format_name},
+    )
+
+
+def rgb_to_yuv_image_response(contents: bytes, standard: str):
+    try:
+        converter = ColorConverter(standard)
+        image = np.asarray(Image.open(io.BytesIO(contents)).convert("RGB"))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid input: {str(e)}")
+    return planar_response(converter.rgb_to_yuv(image), "yuv444p")
+
+
+@app.post("/rgb-to-yuv/image/")
+async def rgb_to_yuv_image(file: UploadFile = File(...), standard: str = "bt601"):
+    return await run_in_threadpool(rgb_to_yuv_image_response, await file.read(), standard)
+
+
+def rgb_to_yuv_raw_response(body: bytes, width: int, height: int, standard: str):
+    try:
+        converter = ColorConverter(standard)
+        image = ColorConverter.from_planar(body, width, height)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return planar_response(converter.rgb_to_yuv(image), "yuv444p")
+
+
+@app.post("/rgb-to-yuv/raw/")
+async def rgb_to_yuv_raw(request: Request, width: int, height: int, standard: str = "bt601"):
+    return await run_in_threadpool(rgb_to_yuv_raw_response, await request.body(), width, height, standard)
+
+
+def yuv_to_rgb_raw_response(body: bytes, width: int, height: int, standard: str, output: str):
+    try:
+        converter = ColorConverter(standard)
+        image = ColorConverter.from_planar(body, width, height)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    rgb = converter.yuv_to_rgb(image)
+    if output == "png":
+        buffer = io.BytesIO()
+        Image.fromarray(rgb).save(buffer, format="PNG")
+        return Response(content=buffer.getvalue(), media_type="image/png")
+    return planar_response(rgb, "rgbp")
+
+
+@app.post("/yuv-to-rgb/raw/")
+async def yuv_to_rgb_raw(request: Request, width: int, height: int, standard: str = "bt601", output: str = "raw"):
+    return await run_in_threadpool(yuv_to_rgb_raw_response, await request.body(), width, height, standard, output)
+
+
+def dct_blocks_encode_response(contents: bytes, block_size: int, quality: int):
+    try:
+        image = np.asarray(Image.open(io.BytesIO(contents)).convert("RGB"))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image: {str(e)}")
+
+    luma = ColorConverter().rgb_to_yuv(image)[..., 0]
+    coefficients = BlockDCTConverter(block_size, quality).encode(luma)
+
+    # int16 keeps the file small, but large blocks at high quality have DC terms past its range
+    int16 = np.iinfo(np.int16)
+    if int16.min <= coefficients.min(initial=0) and coefficients.max(initial=0) <= int16.max:
+        coefficients = coefficients.astype(np.int16)
+
+    buffer = io.BytesIO()
+    np.save(buffer, coefficients)
+    height, width = luma.shape
+    return Response(
+        content=buffer.getvalue(),
+        media_type="application/octet-stream",
+        headers={"X-Width": str(width), "X-Height": str(height)},
+    )
+
+
+@app.post("/dct-blocks/encode/")
+async def dct_blocks_encode(file: UploadFile = File(...), block_size: int = 8, quality: int = 50):
+    if block_size < 1:
+        raise HTTPException(status_code=400, detail="block_size must be at least 1")
+    return await run_in_threadpool(dct_blocks_encode_response, await file.read(), block_size, quality)
+
+
+def dct_blocks_decode_response(contents: bytes, width: int, height: int, block_size: int, quality: int):
+    try:
+        coefficients = np.load(io.BytesIO(contents), allow_pickle=False)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid coefficient file: {str(e)}")
+
+    if coefficients.ndim != 4 or coefficients.shape[2:] != (block_size, block_size):
+        raise HTTPException(status_code=400, detail=f"Expected (rows, cols, {block_size}, {block_size}) coefficients")
+
+    rows, cols = coefficients.shape[:2]
+    plane = BlockDCTConverter(block_size, quality).decode(
+        coefficients, height or rows * block_size, width or cols * block_size
+    )
+
+    buffer = io.BytesIO()
+    Image.fromarray(plane).save(buffer, format="PNG")
+    return Response(content=buffer.getvalue(), media_type="image/png")
+
+
+@app.post("/dct-blocks/decode/")
+async def dct_blocks_decode(file: UploadFile = File(...), width: int = 0, height: int = 0, block_size: int = 8, quality: int = 50):
+    if block_size < 1:
+        raise HTTPException(status_code=400, detail="block_size must be at least 1")
+    return await run_in_threadpool(dct_blocks_decode_response, await file.read(), width, height, block_size, quality)
+
+
 @app.post("/resize/")
 async def resize(scale_factor: float, file: UploadFile = File(...)):
     file_location = f"temp_{file.filename}"
@@ -176,13 +530,21 @@ async def resize(scale_factor: float, file: UploadFile = File(...)):
     return {"output_file": output_path}
 
 
+def serpentine_response(request: Request, body: bytes, dtype: str):
+    if not is_binary(request):
+        matrix = parse_json_body(SerpentineInput, body).matrix
+        N = len(matrix)
+        M = len(matrix[0]) if matrix else 0
+        result = Translator.serpentine(matrix, N, M)
+        return {"serpentine_order": result}
+
+    matrix = read_matrix(request, body, dtype)
+    return array_response(request, zigzag_scan(matrix))
+
+
 @app.post("/serpentine/")
-def serpentine(input_data: SerpentineInput):
-    matrix = input_data.matrix
-    N = len(matrix)
-    M = len(matrix[0]) if matrix else 0
-    result = Translator.serpentine(matrix, N, M)
-    return {"serpentine_order": result}
+async def serpentine(request: Request, dtype: str = "int32"):
+    return await run_in_threadpool(serpentine_response, request, await request.body(), dtype)
 
 
 @app.post("/color-to-bw/")
@@ -203,34 +565,587 @@ async def compress(file: UploadFile = File(...)):
     return {"output_file": output_path}
 
 
+NPY_MEDIA_TYPE = "application/x-npy"
+BINARY_MEDIA_TYPES = ("application/octet-stream", NPY_MEDIA_TYPE)
+
+
+def is_binary(request: Request):
+    return request.headers.get("content-type", "").startswith(BINARY_MEDIA_TYPES)
+
+
+def is_npy(request: Request):
+    return request.headers.get("content-type", "").startswith(NPY_MEDIA_TYPE)
+
+
+def load_npy(buffer: bytes):
+    # Parse the .npy header ourselves so the data is a view on the request body
+    # instead of the copy np.load would make
+    stream = io.BytesIO(buffer)
+    version = np.lib.format.read_magic(stream)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+    elif version == (2, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+    else:
+        return np.load(stream, allow_pickle=False)
+    if dtype.hasobject:
+        raise ValueError("Object arrays are not supported")
+
+    array = np.frombuffer(buffer, dtype=dtype, count=int(np.prod(shape)), offset=stream.tell())
+    return array.reshape(shape, order="F" if fortran_order else "C")
+
+
+# Binary bodies are either .npy files (application/x-npy) or raw bytes described by the X-Dtype and
+# X-Shape headers (e.g. "<f4" and "1024,1024"); raw bodies default to little-endian
+def read_array(request: Request, body: bytes, dtype: str = "float64"):
+    try:
+        if is_npy(request):
+            return load_npy(body)
+
+        dtype = np.dtype(request.headers.get("x-dtype", dtype))
+        if dtype.byteorder == "=":
+            dtype = dtype.newbyteorder("<")
+        array = np.frombuffer(body, dtype=dtype)
+        shape = request.headers.get("x-shape")
+        return array.reshape([int(size) for size in shape.split(",")]) if shape else array
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid binary payload: {str(e)}")
+
+
+def read_matrix(request: Request, body: bytes, dtype: str = "float64"):
+    matrix = read_array(request, body, dtype)
+    if matrix.ndim != 2:
+        raise HTTPException(status_code=400, detail=f"Expected a 2-D matrix, got shape {matrix.shape}")
+    return matrix
+
+
+# Answer in .npy when the client sent or accepts it, otherwise as raw bytes
+def array_response(request: Request, array, headers=None):
+    headers = dict(headers or {})
+    accept = request.headers.get("accept", "")
+    if NPY_MEDIA_TYPE in accept or is_npy(request):
+        buffer = io.BytesIO()
+        np.save(buffer, array)
+        return Response(content=buffer.getvalue(), media_type=NPY_MEDIA_TYPE, headers=headers)
+
+    array = np.ascontiguousarray(array)
+    dtype = array.dtype.newbyteorder("<") if array.dtype.byteorder == "=" else array.dtype
+    headers.update({"X-Dtype": dtype.str, "X-Shape": ",".join(map(str, array.shape))})
+    return Response(content=array.astype(dtype, copy=False).tobytes(), media_type="application/octet-stream", headers=headers)
+
+
+def parse_json_body(model, body: bytes):
+    try:
+        return model.model_validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+
+
+# Large series can be sent as raw little-endian integers or a .npy array
+# and come back in the packed binary run-length format
+def run_length_encoding_response(request: Request, body: bytes, dtype: str):
+    if not is_binary(request):
+        input_data = parse_json_body(RLEncodingInput, body)
+        result = Translator.run_length_encoding(input_data.serie)
+        return {"encoded_serie": result}
+
+    serie = read_array(request, body, dtype)
+    try:
+        packed = rle_to_bytes(*rle_encode(serie))
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Response(content=packed, media_type="application/octet-stream")
+
+
 @app.post("/run-length-encoding/")
-def run_length_encoding(input_data: RLEncodingInput):
-    result = Translator.run_length_encoding(input_data.serie)
-    return {"encoded_serie": result}
+async def run_length_encoding(request: Request, dtype: str = "int32"):
+    return await run_in_threadpool(run_length_encoding_response, request, await request.body(), dtype)
 
 
-@app.post("/dct-encode/")
-def dct_encode(input_data: MatrixInput):
-    matrix = np.array(input_data.matrix)
+def run_length_decoding_response(body: bytes):
+    try:
+        values, lengths = rle_from_bytes(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    serie = rle_decode(values, lengths)
+    return Response(
+        content=serie.astype(serie.dtype.newbyteorder("<")).tobytes(),
+        media_type="application/octet-stream",
+        headers={"X-Dtype": serie.dtype.newbyteorder("<").str},
+    )
+
+
+@app.post("/run-length-decoding/")
+async def run_length_decoding(request: Request):
+    return await run_in_threadpool(run_length_decoding_response, await request.body())
+
+
+def entropy_encode_response(request: Request, body: bytes, method: str, order: int, dtype: str):
+    try:
+        if is_binary(request):
+            serie = read_array(request, body, dtype).ravel()
+        else:
+            serie = np.array(parse_json_body(EntropyInput, body).serie, dtype=np.int64)
+
+        start = time.perf_counter()
+        if method == "huffman":
+            encoded = huffman_encode(serie)
+        elif method == "jpeg-dc":
+            encoded = huffman_encode(serie, HuffmanTable.from_jpeg(JPEG_DC_LUMA))
+        elif method == "jpeg-ac":
+            encoded = huffman_encode(serie, HuffmanTable.from_jpeg(JPEG_AC_LUMA))
+        elif method == "exp-golomb":
+            encoded = exp_golomb_encode(serie, order)
+        else:
+            raise ValueError(f"Unknown entropy coding method: {method}")
+        elapsed = time.perf_counter() - start
+    except OverflowError:
+        raise HTTPException(status_code=400, detail="Values must fit in a signed 64-bit integer")
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return Response(
+        content=encoded,
+        media_type="application/octet-stream",
+        headers={
+            "X-Symbols": str(serie.size),
+            "X-Compressed-Bytes": str(len(encoded)),
+            "X-Bits-Per-Symbol": f"{8 * len(encoded) / max(serie.size, 1):.4f}",
+            "X-Encode-Seconds": f"{elapsed:.6f}",
+        },
+    )
+
+
+@app.post("/entropy/encode/")
+async def entropy_encode(request: Request, method: str = "huffman", order: int = 0, dtype: str = "int32"):
+    if not 0 <= order <= MAX_EXP_GOLOMB_ORDER:
+        raise HTTPException(status_code=400, detail=f"order must be between 0 and {MAX_EXP_GOLOMB_ORDER}")
+    return await run_in_threadpool(entropy_encode_response, request, await request.body(), method, order, dtype)
+
+
+def entropy_decode_response(request: Request, body: bytes):
+    try:
+        serie = decode_stream(body)
+    except (struct.error, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid entropy-coded stream: {str(e)}")
+
+    if "application/octet-stream" in request.headers.get("accept", ""):
+        return Response(content=serie.astype("<i8").tobytes(), media_type="application/octet-stream", headers={"X-Dtype": "<i8"})
+    return {"serie": serie.tolist()}
+
+
+@app.post("/entropy/decode/")
+async def entropy_decode(request: Request):
+    return await run_in_threadpool(entropy_decode_response, request, await request.body())
+
+
+def timings_header(timings):
+    return json.dumps({stage: round(seconds * 1000, 3) for stage, seconds in timings.items()})
+
+
+def codec_encode_response(contents: bytes, quality: int, subsampling: str):
+    try:
+        image = np.asarray(Image.open(io.BytesIO(contents)).convert("RGB"))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image: {str(e)}")
+
+    codec = ImageCodec(quality, subsample=subsampling == "4:2:0")
+    bitstream, timings = codec.encode(image)
+    decoded, _ = codec.decode(bitstream)
+
+    return Response(
+        content=bitstream,
+        media_type="application/octet-stream",
+        headers={
+            "X-Codec-Bytes": str(len(bitstream)),
+            "X-Raw-Bytes": str(image.nbytes),
+            "X-Codec-Bits-Per-Pixel": f"{8 * len(bitstream) / (image.shape[0] * image.shape[1]):.4f}",
+            "X-Codec-PSNR": f"{ImageCodec.psnr(image, decoded):.3f}",
+            "X-Codec-Timings-Ms": timings_header(timings),
+        },
+    )
+
+
+@app.post("/codec/encode/")
+async def codec_encode(file: UploadFile = File(...), quality: int = 75, subsampling: str = "4:2:0"):
+    if subsampling not in ("4:2:0", "4:4:4"):
+        raise HTTPException(status_code=400, detail=f"Invalid chroma subsampling: {subsampling}")
+    return await run_in_threadpool(codec_encode_response, await file.read(), quality, subsampling)
+
+
+def codec_decode_response(body: bytes):
+    try:
+        image, timings = ImageCodec().decode(body)
+    except (struct.error, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid bitstream: {str(e)}")
+
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format="PNG")
+    return Response(
+        content=buffer.getvalue(),
+        media_type="image/png",
+        headers={"X-Codec-Timings-Ms": timings_header(timings)},
+    )
+
+
+@app.post("/codec/decode/")
+async def codec_decode(request: Request):
+    return await run_in_threadpool(codec_decode_response, await request.body())
+
+
+# The numeric endpoints below take JSON or a binary matrix (raw bytes or .npy);
+# binary requests get a binary response in the same format
+def dct_encode_response(request: Request, body: bytes):
     converter = DCTConverter()
+    if is_binary(request):
+        return array_response(request, converter.encode(read_matrix(request, body)))
+
+    matrix = np.array(parse_json_body(MatrixInput, body).matrix)
     result = converter.encode(matrix)
     return {"encoded_matrix": result.tolist()}
 
 
-@app.post("/dct-decode/")
-def dct_decode(input_data: MatrixInput):
-    matrix = np.array(input_data.matrix)
+@app.post("/dct-encode/")
+async def dct_encode(request: Request):
+    return await run_in_threadpool(dct_encode_response, request, await request.body())
+
+
+def dct_decode_response(request: Request, body: bytes):
     converter = DCTConverter()
+    if is_binary(request):
+        return array_response(request, converter.decode(read_matrix(request, body)))
+
+    matrix = np.array(parse_json_body(MatrixInput, body).matrix)
     result = converter.decode(matrix)
     return {"decoded_matrix": result.tolist()}
 
 
-@app.post("/dwt-convert/")
-def dwt_convert(input_data: DWTInput):
-    data = np.array(input_data.data)
+@app.post("/dct-decode/")
+async def dct_decode(request: Request):
+    return await run_in_threadpool(dct_decode_response, request, await request.body())
+
+
+# In binary form both coefficient sets come back stacked as a (2, n) array
+def dwt_convert_response(request: Request, body: bytes):
     converter = DWTConverter()
+    if is_binary(request):
+        # pywt refuses read-only buffers, so the zero-copy view is copied here
+        cA, cD = converter.convert(read_array(request, body).flatten())
+        return array_response(request, np.stack((cA, cD)), {"X-Rows": "approximation,detail"})
+
+    data = np.array(parse_json_body(DWTInput, body).data)
     cA, cD = converter.convert(data)
     return {
         "approximation_coefficients": cA.tolist(),
         "detail_coefficients": cD.tolist(),
-    }
\ No newline at end of file
+    }
+
+
+@app.post("/dwt-convert/")
+async def dwt_convert(request: Request):
+    return await run_in_threadpool(dwt_convert_response, request, await request.body())
+
+
+def read_frames(contents):
+    # Every upload becomes a 3xHxW stack of YUV planes; all frames must share a size
+    frames = [ColorConverter().rgb_to_yuv(np.asarray(Image.open(io.BytesIO(data)).convert("RGB"))) for data in contents]
+    if len({frame.shape for frame in frames}) != 1:
+        raise ValueError("All frames must have the same dimensions")
+    return np.moveaxis(np.stack(frames), -1, 1)
+
+
+def planes_to_png(planes):
+    rgb = ColorConverter().yuv_to_rgb(np.moveaxis(planes, 0, -1))
+    buffer = io.BytesIO()
+    Image.fromarray(rgb).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+# Coefficients come back as one packed float32 .npy array of shape (frames, 3, H, W)
+# with the sub-band layout in the X-Slice-Map header
+def dwt2_decompose_response(contents: List[bytes], wavelet: str, level: Union[int, None], mode: str):
+    try:
+        engine = WaveletEngine(wavelet, level, mode)
+        planes = read_frames(contents)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid input: {str(e)}")
+
+    packed, slice_map = engine.decompose(planes)
+    buffer = io.BytesIO()
+    np.save(buffer, packed)
+    height, width = planes.shape[-2:]
+    return Response(
+        content=buffer.getvalue(),
+        media_type="application/octet-stream",
+        headers={"X-Width": str(width), "X-Height": str(height), "X-Slice-Map": json.dumps(slice_map, separators=(",", ":"))},
+    )
+
+
+@app.post("/dwt2/decompose/")
+async def dwt2_decompose(files: List[UploadFile] = File(...), wavelet: str = "db1", level: Union[int, None] = None, mode: str = "periodization"):
+    contents = [await file.read() for file in files]
+    return await run_in_threadpool(dwt2_decompose_response, contents, wavelet, level, mode)
+
+
+def dwt2_reconstruct_response(contents: bytes, slice_map: str, width: int, height: int, frame: int, wavelet: str, mode: str):
+    try:
+        engine = WaveletEngine(wavelet, mode=mode)
+        packed = np.load(io.BytesIO(contents), allow_pickle=False)
+        planes = engine.reconstruct(packed, json.loads(slice_map), height, width)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid coefficients: {str(e)}")
+
+    if planes.ndim != 4 or planes.shape[1] != 3 or not 0 <= frame < planes.shape[0]:
+        raise HTTPException(status_code=400, detail="Expected (frames, 3, H, W) coefficients and a valid frame index")
+    return Response(content=planes_to_png(planes[frame]), media_type="image/png")
+
+
+@app.post("/dwt2/reconstruct/")
+async def dwt2_reconstruct(file: UploadFile = File(...), slice_map: str = Form(...), width: int = Form(...), height: int = Form(...), frame: int = 0, wavelet: str = "db1", mode: str = "periodization"):
+    # width and height are the X-Width / X-Height returned by /dwt2/decompose/
+    if width < 1 or height < 1:
+        raise HTTPException(status_code=400, detail="width and height must be positive")
+    return await run_in_threadpool(dwt2_reconstruct_response, await file.read(), slice_map, width, height, frame, wavelet, mode)
+
+
+def dwt2_compress_response(contents: bytes, keep: float, threshold_mode: str, wavelet: str, level: Union[int, None], mode: str):
+    try:
+        engine = WaveletEngine(wavelet, level, mode)
+        image = np.asarray(Image.open(io.BytesIO(contents)).convert("RGB"))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid input: {str(e)}")
+
+    planes = np.moveaxis(ColorConverter().rgb_to_yuv(image), -1, 0)
+    reconstructed, kept = engine.compress(planes, keep, threshold_mode)
+    content = planes_to_png(reconstructed)
+    decoded = np.asarray(Image.open(io.BytesIO(content)))
+    return Response(
+        content=content,
+        media_type="image/png",
+        headers={
+            "X-Coefficients-Kept": str(kept),
+            "X-Coefficients-Total": str(planes.size),
+            "X-PSNR": f"{ImageCodec.psnr(image, decoded):.3f}",
+        },
+    )
+
+
+@app.post("/dwt2/compress/")
+async def dwt2_compress(file: UploadFile = File(...), keep: float = 0.1, threshold_mode: str = "hard", wavelet: str = "db1", level: Union[int, None] = None, mode: str = "periodization"):
+    if not 0 < keep <= 1:
+        raise HTTPException(status_code=400, detail="keep must be in (0, 1]")
+    if threshold_mode not in ("hard", "soft"):
+        raise HTTPException(status_code=400, detail=f"Invalid threshold mode: {threshold_mode}")
+    return await run_in_threadpool(dwt2_compress_response, await file.read(), keep, threshold_mode, wavelet, level, mode)
+
+
+def matrix_array(matrix):
+    return np.array(matrix) if matrix else np.zeros((0, 0), dtype=np.int64)
+
+
+def stacked_color(convert):
+    # (..., 3) -> (..., 3) through the scalar formulas, evaluated on whole arrays
+    return lambda stack: np.stack(convert(*np.moveaxis(np.asarray(stack, dtype=np.float64), -1, 0)), axis=-1)
+
+
+def stacked_dwt(stack):
+    cA, cD = DWTConverter().convert(stack)
+    return np.stack((cA, cD), axis=-2)
+
+
+def run_length_many(arrays):
+    return [np.column_stack(pair) for pair in rle_encode_many(arrays)]
+
+
+class BatchOperation(NamedTuple):
+    model: type
+    to_array: callable
+    kernel: callable
+    to_json: callable
+    stackable: bool = True
+
+
+BATCH_OPERATIONS = {
+    "rgb-to-yuv": BatchOperation(
+        RGBInput, lambda item: np.array([item.R, item.G, item.B]), stacked_color(Translator.RGB_to_YUV_2),
+        lambda row: dict(zip(("Y", "U", "V"), row.tolist())),
+    ),
+    "yuv-to-rgb": BatchOperation(
+        YUVInput, lambda item: np.array([item.Y, item.U, item.V]), stacked_color(Translator.YUV_to_RGB_2),
+        lambda row: dict(zip(("R", "G", "B"), row.tolist())),
+    ),
+    "dct-encode": BatchOperation(
+        MatrixInput, lambda item: np.array(item.matrix), DCTConverter().encode,
+        lambda row: {"encoded_matrix": row.tolist()},
+    ),
+    "dct-decode": BatchOperation(
+        MatrixInput, lambda item: np.array(item.matrix), DCTConverter().decode,
+        lambda row: {"decoded_matrix": row.tolist()},
+    ),
+    "serpentine": BatchOperation(
+        SerpentineInput, lambda item: matrix_array(item.matrix), zigzag_scan,
+        lambda row: {"serpentine_order": row.tolist()},
+    ),
+    "dwt-convert": BatchOperation(
+        DWTInput, lambda item: np.array(item.data), stacked_dwt,
+        lambda row: {"approximation_coefficients": row[0].tolist(), "detail_coefficients": row[1].tolist()},
+    ),
+    "run-length-encoding": BatchOperation(
+        RLEncodingInput, lambda item: np.array(item.serie, dtype=np.int64), run_length_many,
+        lambda row: {"encoded_serie": row.tolist()}, stackable=False,
+    ),
+}
+
+
+def run_stacked(kernel, arrays):
+    # Inputs of the same shape are stacked and go through the kernel together
+    results = [None] * len(arrays)
+    groups = {}
+    for index, array in enumerate(arrays):
+        groups.setdefault(array.shape, []).append(index)
+    for indices in groups.values():
+        output = kernel(np.stack([arrays[index] for index in indices]))
+        for index, row in zip(indices, output):
+            results[index] = row
+    return results
+
+
+def batch_inputs(operations):
+    # Validate every item up front so a bad one fails the batch before any work
+    inputs = []
+    for index, item in enumerate(operations):
+        if item.op not in BATCH_OPERATIONS:
+            raise HTTPException(status_code=400, detail=f"Operation {index}: unknown operation {item.op}")
+        try:
+            inputs.append(BATCH_OPERATIONS[item.op].model.model_validate(item.input))
+        except ValidationError as e:
+            raise RequestValidationError([
+                {**error, "loc": ("body", "operations", index, "input", *error["loc"])} for error in e.errors()
+            ])
+    return inputs
+
+
+# JSON batches mix operations freely and results come back in request order; each
+# operation type runs as one vectorized call. A binary body (.npy or raw) is a
+# single stacked array for the operation named in the query string.
+def batch_response(request: Request, body: bytes, op: Union[str, None], dtype: str):
+    if is_binary(request):
+        operation = BATCH_OPERATIONS.get(op)
+        if operation is None or not operation.stackable:
+            raise HTTPException(status_code=400, detail=f"Unsupported operation for stacked input: {op}")
+        try:
+            return array_response(request, operation.kernel(read_array(request, body, dtype)))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    operations = parse_json_body(BatchInput, body).operations
+    inputs = batch_inputs(operations)
+
+    by_operation = {}
+    for index, item in enumerate(operations):
+        by_operation.setdefault(item.op, []).append(index)
+
+    results = [None] * len(operations)
+    for name, indices in by_operation.items():
+        operation = BATCH_OPERATIONS[name]
+        try:
+            arrays = [operation.to_array(inputs[index]) for index in indices]
+            outputs = run_stacked(operation.kernel, arrays) if operation.stackable else operation.kernel(arrays)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"{name}: {str(e)}")
+        for index, output in zip(indices, outputs):
+            results[index] = operation.to_json(output)
+
+    return {"results": results}
+
+
+@app.post("/batch/")
+async def batch(request: Request, op: Union[str, None] = None, dtype: str = "float64"):
+    return await run_in_threadpool(batch_response, request, await request.body(), op, dtype)
+
+
+# Decode a single frame, picked by index or by time, without writing images to disk
+def video_frame_response(contents: bytes, filename: str, index: int, time_offset: Union[float, None], output: str):
+    descriptor, input_path = tempfile.mkstemp(suffix=os.path.splitext(filename or "")[1])
+    try:
+        with os.fdopen(descriptor, "wb") as f:
+            f.write(contents)
+        if time_offset is not None:
+            reader = FrameReader(input_path, start=time_offset, max_frames=1)
+        else:
+            reader = FrameReader(input_path, start_frame=index, max_frames=1)
+        frame = reader.read()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ffmpeg.Error as e:
+        error_message = e.stderr.decode("utf-8") if e.stderr else "Unknown FFmpeg error occurred"
+        raise HTTPException(status_code=500, detail=f"FFmpeg error: {error_message}")
+    finally:
+        os.remove(input_path)
+
+    if frame is None:
+        raise HTTPException(status_code=404, detail="No frame at the requested position")
+
+    headers = {"X-Frame-Index": str(frame.index), "X-Frame-Time": f"{frame.time:.6f}"}
+    if output == "raw":
+        headers.update({"X-Width": str(reader.width), "X-Height": str(reader.height), "X-Pixel-Format": reader.pix_fmt})
+        return Response(content=frame.buffer.tobytes(), media_type="application/octet-stream", headers=headers)
+
+    buffer = io.BytesIO()
+    Image.fromarray(ColorConverter().yuv_to_rgb(frame_to_yuv(frame))).save(buffer, format="PNG")
+    return Response(content=buffer.getvalue(), media_type="image/png", headers=headers)
+
+
+@app.post("/video/frame/")
+async def video_frame(file: UploadFile = File(...), index: int = 0, time_offset: Union[float, None] = None, output: str = "png"):
+    if output not in ("png", "raw"):
+        raise HTTPException(status_code=400, detail=f"Invalid output: {output}")
+    return await run_in_threadpool(video_frame_response, await file.read(), file.filename, index, time_offset, output)
+
+
+# Round-trip every frame through the blockwise DCT at the given quality and encode the
+# result, piping frames from the decoder to the encoder without touching the disk
+def dct_requantize_response(contents: bytes, filename: str, quality: int, codec: str, max_frames: Union[int, None]):
+    container = supported_codecs[codec.lower()][1]
+
+    descriptor, input_path = tempfile.mkstemp(suffix=os.path.splitext(filename or "")[1])
+    output_path = f"{input_path}.out.{container}"
+    try:
+        with os.fdopen(descriptor, "wb") as f:
+            f.write(contents)
+
+        reader = FrameReader(input_path, max_frames=max_frames)
+        chroma_converter = BlockDCTConverter(quality=quality, chroma=True)
+        converters = (BlockDCTConverter(quality=quality), chroma_converter, chroma_converter)
+        with FrameWriter(output_path, reader.width, reader.height, codec, reader.fps or 25) as writer:
+            for frame in reader:
+                writer.write(tuple(
+                    converter.decode(converter.encode(plane), *plane.shape)
+                    for converter, plane in zip(converters, frame.planes)
+                ))
+
+        with open(output_path, "rb") as f:
+            content = f.read()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ffmpeg.Error as e:
+        error_message = e.stderr.decode("utf-8") if e.stderr else "Unknown FFmpeg error occurred"
+        raise HTTPException(status_code=500, detail=f"FFmpeg error: {error_message}")
+    finally:
+        os.remove(input_path)
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+    return Response(
+        content=content,
+        media_type=f"video/{container}",
+        headers={"X-Frames": str(writer.frames_written)},
+    )
+
+
+@app.post("/video/dct-requantize/")
+async def video_dct_requantize(file: UploadFile = File(...), quality: int = 50, codec: str = "vp9", max_frames: Union[int, None] = None):
+    if codec.lower() not in supported_codecs:
+        raise HTTPException(status_code=400, detail=f"Unsupported codec: {codec}")
+    return await run_in_threadpool(dct_requantize_response, await file.read(), file.filename, quality, codec, max_frames)
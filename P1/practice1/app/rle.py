@@ -0,0 +1,125 @@
+import struct
+
+import numpy as np
+
+
+MAGIC = b"RLE1"
+HEADER = struct.Struct("<4s8sQ")  # magic, value dtype, number of runs
+MAX_DECODED_BYTES = 1 << 28  # a few bytes of runs can ask for terabytes once expanded
+
+
+def rle_encode(series):
+    # Runs start wherever the value changes; returns (values, run lengths)
+    series = np.asarray(series).ravel()
+    if series.size == 0:
+        return series[:0], np.zeros(0, dtype=np.int64)
+
+    starts = np.concatenate(([0], np.flatnonzero(series[1:] != series[:-1]) + 1))
+    lengths = np.diff(np.append(starts, series.size))
+    return series[starts], lengths
+
+
+def rle_encode_many(series):
+    # Encode several series in one pass over their concatenation; runs are also
+    # cut at series boundaries so none of them spans two inputs
+    series = [np.asarray(serie).ravel() for serie in series]
+    sizes = np.array([serie.size for serie in series], dtype=np.int64)
+    if sizes.sum() == 0:
+        return [rle_encode(serie) for serie in series]
+
+    joined = np.concatenate(series)
+    boundaries = np.cumsum(sizes)[:-1]
+    change = np.ones(joined.size, dtype=bool)
+    change[1:] = joined[1:] != joined[:-1]
+    change[boundaries[boundaries < joined.size]] = True
+
+    starts = np.flatnonzero(change)
+    lengths = np.diff(np.append(starts, joined.size))
+    splits = np.searchsorted(starts, boundaries)
+    return list(zip(np.split(joined[starts], splits), np.split(lengths, splits)))
+
+
+def rle_decode(values, lengths):
+    return np.repeat(np.asarray(values), np.asarray(lengths))
+
+
+def zigzag_signed(values):
+    # Map signed integers to unsigned ones so small magnitudes get short varints
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def unzigzag_signed(values):
+    values = np.asarray(values, dtype=np.uint64)
+    return ((values >> np.uint64(1)).astype(np.int64)) ^ -((values & np.uint64(1)).astype(np.int64))
+
+
+def varint_pack(values):
+    # LEB128: 7 bits per byte, high bit set on every byte but the last one.
+    # Each pass writes the k-th byte of every value that is long enough.
+    values = np.asarray(values, dtype=np.uint64)
+    sizes = np.ones(values.size, dtype=np.int64)
+    for k in range(1, 10):
+        sizes += values >= np.uint64(1 << (7 * k))
+
+    offsets = np.cumsum(sizes) - sizes
+    packed = np.empty(int(sizes.sum()), dtype=np.uint8)
+    for k in range(int(sizes.max(initial=0))):
+        present = sizes > k
+        chunk = ((values[present] >> np.uint64(7 * k)) & np.uint64(0x7F)).astype(np.uint8)
+        chunk[sizes[present] > k + 1] |= 0x80
+        packed[offsets[present] + k] = chunk
+    return packed.tobytes()
+
+
+def varint_unpack(buffer, count=None):
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    ends = np.flatnonzero((data & 0x80) == 0)
+    if count is not None:
+        if ends.size < count:
+            raise ValueError(f"Expected {count} varints, found {ends.size}")
+        ends = ends[:count]
+    if ends.size == 0:
+        return np.zeros(0, dtype=np.uint64)
+
+    data = data[:ends[-1] + 1]
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    position = np.arange(data.size) - np.repeat(starts, ends - starts + 1)
+    parts = (data & 0x7F).astype(np.uint64) << (7 * position).astype(np.uint64)
+    return np.add.reduceat(parts, starts)
+
+
+def rle_to_bytes(values, lengths):
+    values = np.asarray(values)
+    if values.dtype.kind not in "iub":
+        raise ValueError(f"Only integer series can be packed, got {values.dtype}")
+    header = HEADER.pack(MAGIC, values.dtype.str.encode("ascii"), values.size)
+    return header + varint_pack(zigzag_signed(values)) + varint_pack(lengths)
+
+
+def rle_from_bytes(buffer):
+    if len(buffer) < HEADER.size:
+        raise ValueError("Truncated run-length stream")
+    magic, dtype, count = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise ValueError("Not a run-length stream")
+
+    try:
+        dtype = np.dtype(dtype.rstrip(b"\0").decode("ascii"))
+    except (TypeError, UnicodeDecodeError) as e:
+        raise ValueError(f"Unknown value dtype in run-length stream: {e}")
+    if dtype.kind not in "iub":
+        raise ValueError(f"Run-length stream values must be integers, got {dtype}")
+
+    numbers = varint_unpack(memoryview(buffer)[HEADER.size:], 2 * count)
+    values = unzigzag_signed(numbers[:count]).astype(dtype)
+
+    # Checked before the int64 cast, where lengths of 2^63 or more would turn negative
+    lengths = numbers[count:]
+    max_values = MAX_DECODED_BYTES // dtype.itemsize
+    if np.any((lengths < 1) | (lengths > max_values)):
+        raise ValueError("Run lengths must be between 1 and the decoded size limit")
+    lengths = lengths.astype(np.int64)
+    if lengths.sum() > max_values:
+        raise ValueError(f"Decoded series would exceed {MAX_DECODED_BYTES} bytes")
+    return values, lengths
@@ -0,0 +1,82 @@
+import numpy as np
+import pywt
+
+
+class WaveletEngine:
+    # Multi-level 2D wavelet decomposition of image planes. Accepts a single HxW
+    # plane or an NxHxW stack of planes, transformed together along the last two axes.
+    def __init__(self, wavelet="db1", level=None, mode="periodization"):
+        if wavelet not in pywt.wavelist(kind="discrete"):
+            raise ValueError(f"Unknown discrete wavelet: {wavelet}")
+        if mode not in pywt.Modes.modes:
+            raise ValueError(f"Unknown signal extension mode: {mode}")
+        self.wavelet = wavelet
+        self.level = level
+        self.mode = mode
+
+    def decompose(self, planes):
+        # Returns one packed coefficient array (same leading axes as the input) and
+        # the slice map locating every sub-band inside it
+        planes = np.asarray(planes, dtype=np.float32)
+        coeffs = pywt.wavedec2(planes, self.wavelet, mode=self.mode, level=self.level, axes=(-2, -1))
+        packed, slices = pywt.coeffs_to_array(coeffs, axes=(-2, -1))
+        return packed, slice_map_from_pywt(slices)
+
+    def reconstruct(self, packed, slice_map, height=None, width=None):
+        # Odd sizes come back padded by the transform; pass the original size to crop it
+        packed = np.asarray(packed)
+        slices = slice_map_to_pywt(slice_map, packed.ndim)
+        coeffs = pywt.array_to_coeffs(packed, slices, output_format="wavedec2")
+        planes = pywt.waverec2(coeffs, self.wavelet, mode=self.mode, axes=(-2, -1))
+        if (height is not None and height > planes.shape[-2]) or (width is not None and width > planes.shape[-1]):
+            raise ValueError(f"Size {width}x{height} is larger than the reconstructed {planes.shape[-1]}x{planes.shape[-2]}")
+        return planes[..., :height, :width]
+
+    @staticmethod
+    def threshold(packed, slice_map, keep=0.1, mode="hard"):
+        # Zero all but the largest `keep` fraction of detail coefficients in every
+        # plane; the approximation band is always kept
+        packed = np.array(packed, copy=True)
+        detail = np.ones(packed.shape[-2:], dtype=bool)
+        (row_start, row_stop), (col_start, col_stop) = slice_map["approximation"]
+        detail[row_start:row_stop, col_start:col_stop] = False
+
+        magnitudes = np.abs(packed[..., detail])
+        limits = np.quantile(magnitudes, 1 - keep, axis=-1, keepdims=True)
+        packed[..., detail] = pywt.threshold(packed[..., detail], limits, mode=mode)
+
+        kept = int(np.count_nonzero(packed[..., detail])) + int((~detail).sum()) * (packed.size // detail.size)
+        return packed, kept
+
+    def compress(self, planes, keep=0.1, mode="hard"):
+        planes = np.asarray(planes)
+        packed, slice_map = self.decompose(planes)
+        packed, kept = self.threshold(packed, slice_map, keep, mode)
+        reconstructed = self.reconstruct(packed, slice_map, *planes.shape[-2:])
+        return reconstructed, kept
+
+
+def _bounds(index):
+    return [index.start or 0, index.stop]
+
+
+def slice_map_from_pywt(slices):
+    # Keep only the two image axes so the map does not depend on the batch size
+    return {
+        "approximation": [_bounds(index) for index in slices[0][-2:]],
+        "details": [
+            {band: [_bounds(index) for index in level[band][-2:]] for band in ("ad", "da", "dd")}
+            for level in slices[1:]
+        ],
+    }
+
+
+def slice_map_to_pywt(slice_map, ndim):
+    leading = (slice(None),) * (ndim - 2)
+
+    def to_slices(bounds):
+        return leading + tuple(slice(start, stop) for start, stop in bounds)
+
+    return [to_slices(slice_map["approximation"])] + [
+        {band: to_slices(bounds) for band, bounds in level.items()} for level in slice_map["details"]
+    ]
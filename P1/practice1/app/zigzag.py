@@ -0,0 +1,38 @@
+from functools import lru_cache
+
+import numpy as np
+
+
+@lru_cache(maxsize=None)
+def zigzag_indices(rows, cols):
+    # Flat indices of a rows x cols block in JPEG zigzag order: walk the anti-diagonals,
+    # going down on odd ones and up on even ones
+    i, j = np.indices((rows, cols)).reshape(2, -1)
+    diagonal = i + j
+    order = np.lexsort((np.where(diagonal % 2 == 1, i, -i), diagonal))
+    order.setflags(write=False)
+    return order
+
+
+@lru_cache(maxsize=None)
+def inverse_zigzag_indices(rows, cols):
+    inverse = np.argsort(zigzag_indices(rows, cols))
+    inverse.setflags(write=False)
+    return inverse
+
+
+def zigzag_scan(blocks):
+    # (..., rows, cols) -> (..., rows * cols); works on one block or a stack of them
+    blocks = np.asarray(blocks)
+    rows, cols = blocks.shape[-2:]
+    flat = blocks.reshape(*blocks.shape[:-2], rows * cols)
+    return np.take(flat, zigzag_indices(rows, cols), axis=-1)
+
+
+def inverse_zigzag_scan(coefficients, rows, cols):
+    # (..., rows * cols) -> (..., rows, cols)
+    coefficients = np.asarray(coefficients)
+    if coefficients.shape[-1] != rows * cols:
+        raise ValueError(f"Expected {rows * cols} coefficients per block, got {coefficients.shape[-1]}")
+    blocks = np.take(coefficients, inverse_zigzag_indices(rows, cols), axis=-1)
+    return blocks.reshape(*coefficients.shape[:-1], rows, cols)
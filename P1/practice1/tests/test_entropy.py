@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from app.entropy import (
+    MAX_CODE_LENGTH, HuffmanTable, JPEG_AC_LUMA, decode_stream, exp_golomb_encode, huffman_encode,
+)
+
+
+def fibonacci_counts(size):
+    counts = [1, 1]
+    while len(counts) < size:
+        counts.append(counts[-1] + counts[-2])
+    return counts
+
+
+def test_huffman_round_trip():
+    values = np.random.default_rng(0).geometric(0.3, 10_000) - 5
+    assert np.array_equal(decode_stream(huffman_encode(values)), values)
+
+
+def test_huffman_limits_code_lengths():
+    # Fibonacci frequencies give an unbalanced tree with codes far longer than the limit
+    counts = fibonacci_counts(40)
+    values = np.repeat(np.arange(len(counts)), np.minimum(counts, 50_000))
+    values = np.concatenate((values, np.repeat(np.arange(30), counts[:30])))
+
+    table = HuffmanTable.from_frequencies(values)
+    assert table.lengths.max() == MAX_CODE_LENGTH
+    assert np.sum(2.0 ** -table.lengths) == 1
+    assert np.array_equal(decode_stream(huffman_encode(values, table)), values)
+
+
+def test_huffman_largest_alphabet():
+    values = np.concatenate((np.arange(1 << MAX_CODE_LENGTH), np.zeros(1000, dtype=np.int64)))
+    table = HuffmanTable.from_frequencies(values)
+    assert table.lengths.max() == MAX_CODE_LENGTH
+    assert np.array_equal(decode_stream(huffman_encode(values, table)), values)
+
+
+def test_huffman_alphabet_too_large():
+    with pytest.raises(ValueError):
+        huffman_encode(np.arange((1 << MAX_CODE_LENGTH) + 1))
+
+
+def test_jpeg_table_round_trip():
+    values = np.array(JPEG_AC_LUMA[1] * 3)
+    table = HuffmanTable.from_jpeg(JPEG_AC_LUMA)
+    assert np.array_equal(decode_stream(huffman_encode(values, table)), values)
+
+
+@pytest.mark.parametrize("order", [0, 3, 31])
+def test_exp_golomb_round_trip(order):
+    values = np.concatenate((np.random.default_rng(1).integers(-1000, 1000, 5000), [0, 1, -1, 2**40, -(2**40)]))
+    assert np.array_equal(decode_stream(exp_golomb_encode(values, order)), values)
+
+
+def test_empty_streams():
+    assert decode_stream(huffman_encode([])).size == 0
+    assert decode_stream(exp_golomb_encode([])).size == 0
+
+
+@pytest.mark.parametrize("encode", [huffman_encode, exp_golomb_encode])
+def test_truncated_stream(encode):
+    data = encode(np.random.default_rng(2).integers(-20, 20, 1000))
+    with pytest.raises(ValueError):
+        decode_stream(data[:-10])
+
+
+def test_exp_golomb_extremes():
+    # Above 2^53 a float64 bit length would round; the sign mapping must not overflow either
+    values = np.array([-(2**53 - 1), 3, -7, 2**53 + 1, -(2**62 - 1), 2**63 - 1, -(2**63 - 1)], dtype=np.int64)
+    assert np.array_equal(decode_stream(exp_golomb_encode(values)), values)
+    assert np.array_equal(decode_stream(exp_golomb_encode([2**63 - 1], 1)), [2**63 - 1])
+
+
+@pytest.mark.parametrize("value, order", [(-(2**63), 0), (-(2**63 - 1), 1), (2**63 - 1, 2), (2**63 - 2**30 + 1, 31)])
+def test_exp_golomb_rejects_values_that_do_not_fit(value, order):
+    with pytest.raises(ValueError):
+        exp_golomb_encode(np.array([value], dtype=np.int64), order)
@@ -0,0 +1,134 @@
+import argparse
+import json
+import os
+import re
+import resource
+import shutil
+import tempfile
+import time
+
+import ffmpeg
+
+from .encoders import CPU_THREADS, PROFILES, output_args_for, supported_codecs
+
+
+# Encode a reference clip with every codec/profile pair and report speed and quality
+# against the CPU time spent, so profiles can be chosen on measured data:
+#
+#   python -m app.benchmark --codecs vp9 av1 --profiles realtime fast --duration 5
+
+PSNR_PATTERN = re.compile(r"PSNR .*average:(inf|[\d.]+)")
+SSIM_PATTERN = re.compile(r"SSIM .*All:([\d.]+)")
+
+
+def prepare_reference(path: str, source: str = None, duration: float = 5, size: str = "1280x720", rate: int = 30):
+    # Decode the source once into a lossless file so every encode starts from the same frames
+    if source:
+        stream = ffmpeg.input(source, t=duration)
+    else:
+        stream = ffmpeg.input(f"testsrc2=size={size}:rate={rate}", format="lavfi", t=duration)
+    stream.video.output(path, vcodec="ffv1", format="matroska").overwrite_output().run(quiet=True)
+
+    probe = ffmpeg.probe(path, count_packets=None)
+    video = next(stream for stream in probe["streams"] if stream.get("codec_type") == "video")
+    return int(video["nb_read_packets"]), float(probe["format"]["duration"])
+
+
+def children_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def encode(reference: str, output_path: str, codec: str, container: str, profile: str, threads: int = None):
+    start_wall, start_cpu = time.perf_counter(), children_cpu_seconds()
+    ffmpeg.input(reference).video.output(
+        output_path, vcodec=codec, format=container, **output_args_for(codec, profile, threads)
+    ).overwrite_output().run(quiet=True)
+    return time.perf_counter() - start_wall, children_cpu_seconds() - start_cpu
+
+
+def quality(encoded: str, reference: str):
+    distorted = ffmpeg.input(encoded).video.filter_multi_output("split")
+    original = ffmpeg.input(reference).video.filter_multi_output("split")
+    psnr = ffmpeg.filter([distorted.stream(0), original.stream(0)], "psnr")
+    ssim = ffmpeg.filter([distorted.stream(1), original.stream(1)], "ssim")
+    _, stderr = ffmpeg.merge_outputs(
+        psnr.output("-", format="null"), ssim.output("-", format="null")
+    ).run(capture_stdout=True, capture_stderr=True)
+
+    log = stderr.decode("utf-8", errors="replace")
+    psnr_match, ssim_match = PSNR_PATTERN.search(log), SSIM_PATTERN.search(log)
+    return (
+        float(psnr_match.group(1)) if psnr_match else None,
+        float(ssim_match.group(1)) if ssim_match else None,
+    )
+
+
+def run_benchmark(codecs, profiles, source=None, duration=5, size="1280x720", rate=30, threads=CPU_THREADS, report=print):
+    work_dir = tempfile.mkdtemp(prefix="benchmark_")
+    results = []
+    try:
+        reference = os.path.join(work_dir, "reference.mkv")
+        frames, clip_duration = prepare_reference(reference, source, duration, size, rate)
+
+        for codec in codecs:
+            codec_name, container = supported_codecs[codec]
+            for profile in profiles:
+                output_path = os.path.join(work_dir, f"{codec}.{profile}.{container}")
+                wall, cpu = encode(reference, output_path, codec_name, container, profile, threads)
+                psnr, ssim = quality(output_path, reference)
+                result = {
+                    "codec": codec,
+                    "profile": profile,
+                    "threads": threads,
+                    "wall_seconds": round(wall, 3),
+                    "cpu_seconds": round(cpu, 3),
+                    "fps": round(frames / wall, 2) if wall else None,
+                    "bitrate_kbps": round(os.path.getsize(output_path) * 8 / clip_duration / 1000, 1),
+                    "psnr": psnr,
+                    "ssim": ssim,
+                    "psnr_per_cpu_second": round(psnr / cpu, 3) if psnr is not None and cpu else None,
+                    "ssim_per_cpu_second": round(ssim / cpu, 4) if ssim is not None and cpu else None,
+                }
+                results.append(result)
+                report(result)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def format_row(result):
+    return (
+        f"{result['codec']:<5} {result['profile']:<9} {result['fps'] or 0:>8.2f} {result['bitrate_kbps']:>10.1f} "
+        f"{result['psnr'] or 0:>7.2f} {result['ssim'] or 0:>7.4f} {result['cpu_seconds']:>8.2f} "
+        f"{result['psnr_per_cpu_second'] or 0:>9.3f} {result['ssim_per_cpu_second'] or 0:>9.4f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark encoder speed profiles on a reference clip")
+    parser.add_argument("--input", help="Reference video (default: a generated testsrc2 clip)")
+    parser.add_argument("--duration", type=float, default=5, help="Seconds of the reference to encode")
+    parser.add_argument("--size", default="1280x720", help="Size of the generated reference")
+    parser.add_argument("--rate", type=int, default=30, help="Frame rate of the generated reference")
+    parser.add_argument("--codecs", nargs="+", choices=list(supported_codecs), default=list(supported_codecs))
+    parser.add_argument("--profiles", nargs="+", choices=PROFILES, default=list(PROFILES))
+    parser.add_argument("--threads", type=int, default=CPU_THREADS, help="Encoder threads per run")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    if args.json:
+        report = lambda result: None
+    else:
+        print(f"{'codec':<5} {'profile':<9} {'fps':>8} {'kbps':>10} {'psnr':>7} {'ssim':>7} {'cpu_s':>8} {'psnr/cpu':>9} {'ssim/cpu':>9}")
+        report = lambda result: print(format_row(result), flush=True)
+
+    results = run_benchmark(
+        args.codecs, args.profiles, args.input, args.duration, args.size, args.rate, args.threads, report
+    )
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
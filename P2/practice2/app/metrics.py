@@ -0,0 +1,200 @@
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import ffmpeg
+
+
+# In-process metrics served in the Prometheus text exposition format on /metrics, so
+# any scraper (or curl) can read them without running a separate service.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+CPU_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+MEMORY_BUCKETS = tuple(2 ** power * 1024 ** 2 for power in range(3, 15))  # 8 MiB .. 16 GiB
+
+
+def format_labels(labels: dict):
+    if not labels:
+        return ""
+    escaped = (
+        str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        for value in labels.values()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def format_value(value: float):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, label_names: tuple = ()):
+        self.name = name
+        self.help = help
+        self.type = "counter"
+        self.label_names = label_names
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for key, value in sorted(values.items()):
+            yield self.name, dict(zip(self.label_names, key)), value
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.type = "histogram"
+        self.label_names = label_names
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.values = {}  # labels -> ([count per bucket], sum)
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self.values[key] = (counts, total + value)
+
+    def samples(self):
+        with self.lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self.values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            labels = dict(zip(self.label_names, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f"{self.name}_bucket", {**labels, "le": format_value(bound)}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Gauge:
+    # Read when scraped: `collect` returns a number, or (labels, value) pairs
+    def __init__(self, name: str, help: str, collect):
+        self.name = name
+        self.help = help
+        self.type = "gauge"
+        self.collect = collect
+
+    def samples(self):
+        values = self.collect()
+        if isinstance(values, (int, float)):
+            values = [({}, values)]
+        for labels, value in values:
+            yield self.name, labels, value
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        # Registering a name again replaces it, so a reloaded module does not duplicate series
+        with self.lock:
+            self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.register(Histogram(
+    "video_stage_duration_seconds", "Wall time of each processing stage.", ("stage",)
+))
+ffmpeg_runs = registry.register(Counter(
+    "video_ffmpeg_runs_total", "ffmpeg processes run, by stage and outcome.", ("stage", "status")
+))
+ffmpeg_cpu_seconds = registry.register(Histogram(
+    "video_ffmpeg_cpu_seconds", "User plus system CPU time of each ffmpeg process.", ("stage",), CPU_BUCKETS
+))
+ffmpeg_max_rss_bytes = registry.register(Histogram(
+    "video_ffmpeg_max_rss_bytes", "Peak resident memory of each ffmpeg process.", ("stage",), MEMORY_BUCKETS
+))
+bytes_in = registry.register(Counter("video_bytes_in_total", "Bytes received in uploads."))
+bytes_out = registry.register(Counter(
+    "video_bytes_out_total", "Bytes of results written to files or streamed to clients.", ("kind",)
+))
+
+
+@contextmanager
+def timed(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, stage=stage)
+
+
+def wait_ffmpeg(process, stage: str, start: float = None):
+    # Reap the process with wait4, which returns the rusage of that one child (CPU time
+    # and peak RSS) rather than the totals of every child RUSAGE_CHILDREN would give
+    try:
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    except ChildProcessError:
+        # Already reaped through Popen (e.g. by poll()); only the outcome is known
+        usage = None
+        process.wait()
+
+    if start is not None:
+        stage_seconds.observe(time.perf_counter() - start, stage=stage)
+    if usage is not None:
+        ffmpeg_cpu_seconds.observe(usage.ru_utime + usage.ru_stime, stage=stage)
+        ffmpeg_max_rss_bytes.observe(usage.ru_maxrss * 1024, stage=stage)  # ru_maxrss is in KiB on Linux
+    ffmpeg_runs.inc(stage=stage, status="ok" if process.returncode == 0 else "error")
+    return process.returncode
+
+
+def run_ffmpeg(stream, stage: str):
+    # Same as ffmpeg-python's run(capture_stdout=True, capture_stderr=True) but measured
+    # under `stage`; raises ffmpeg.Error with the captured stderr on failure
+    start = time.perf_counter()
+    process = stream.run_async(pipe_stdout=True, pipe_stderr=True)
+
+    stderr_chunks = []
+    stderr_thread = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+    stderr_thread.start()
+    stdout = process.stdout.read()
+    stderr_thread.join()
+    process.stdout.close()
+    process.stderr.close()
+
+    stderr = b"".join(stderr_chunks)
+    if wait_ffmpeg(process, stage, start) != 0:
+        raise ffmpeg.Error("ffmpeg", stdout, stderr)
+    return stdout, stderr
+
+
+def record_output(path: str):
+    if path and os.path.exists(path):
+        bytes_out.inc(os.path.getsize(path), kind="file")
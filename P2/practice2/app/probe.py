@@ -0,0 +1,87 @@
+import os
+import threading
+from collections import OrderedDict
+from fractions import Fraction
+from typing import NamedTuple
+
+import ffmpeg
+from fastapi import HTTPException
+
+from .metrics import timed
+
+
+PROBE_CACHE_SIZE = int(os.environ.get("PROBE_CACHE_SIZE", 1024))
+
+
+class ProbeResult(NamedTuple):
+    streams: list
+    format: dict
+    video: dict
+    frame_rate: float
+    duration: float
+
+    def streams_of_type(self, codec_type: str):
+        return [stream for stream in self.streams if stream.get("codec_type") == codec_type]
+
+
+def parse_frame_rate(value: str):
+    # ffprobe reports rates as fractions such as "30000/1001" or "0/0"
+    try:
+        return float(Fraction(value))
+    except (ValueError, ZeroDivisionError, TypeError):
+        return 0.0
+
+
+def run_probe(path: str):
+    try:
+        probe = ffmpeg.probe(path)
+    except ffmpeg.Error as e:
+        error_message = e.stderr.decode("utf-8") if e.stderr else "Unknown FFmpeg error occurred"
+        raise HTTPException(status_code=500, detail=f"FFmpeg error: {error_message}")
+
+    streams = probe.get("streams", [])
+    video = next((stream for stream in streams if stream.get("codec_type") == "video"), None)
+    duration = probe.get("format", {}).get("duration")
+    return ProbeResult(
+        streams=streams,
+        format=probe.get("format", {}),
+        video=video,
+        frame_rate=parse_frame_rate(video.get("avg_frame_rate", "0")) if video else 0.0,
+        duration=float(duration) if duration else 0.0,
+    )
+
+
+class ProbeCache:
+    # ffprobe runs at most once per unique content hash; results are kept in a
+    # bounded LRU so hot files are answered from memory
+    def __init__(self, max_entries: int = PROBE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def probe(self, path: str, content_hash: str):
+        with self.lock:
+            if content_hash in self.entries:
+                self.entries.move_to_end(content_hash)
+                return self.entries[content_hash]
+            key_lock = self.pending.setdefault(content_hash, threading.Lock())
+
+        # Concurrent requests for the same content wait for a single ffprobe run
+        with key_lock:
+            with self.lock:
+                if content_hash in self.entries:
+                    return self.entries[content_hash]
+
+            try:
+                with timed("probe"):
+                    result = run_probe(path)
+                with self.lock:
+                    self.entries[content_hash] = result
+                    while len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+            finally:
+                with self.lock:
+                    self.pending.pop(content_hash, None)
+
+        return result
@@ -0,0 +1,80 @@
+import re
+import threading
+import time
+
+import ffmpeg
+
+from .metrics import wait_ffmpeg
+
+
+DURATION_PATTERN = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+
+
+def _number(value: str, cast=float):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_progress_block(fields: dict, duration: float = None):
+    # Turn one key=value block of `-progress` output into numbers
+    out_time_us = _number(fields.get("out_time_us") or fields.get("out_time_ms"), int)  # both are in microseconds
+    out_time = max(out_time_us or 0, 0) / 1_000_000
+
+    snapshot = {
+        "frame": _number(fields.get("frame"), int) or 0,
+        "fps": _number(fields.get("fps")) or 0.0,
+        "speed": _number(fields.get("speed", "").rstrip("x")),
+        "out_time": round(out_time, 3),
+        "duration": duration,
+        "percent": None,
+        "finished": fields.get("progress") == "end",
+    }
+    if duration:
+        snapshot["percent"] = 100.0 if snapshot["finished"] else round(min(out_time / duration, 1.0) * 100, 1)
+    return snapshot
+
+
+def overall_percent(tasks: dict):
+    percents = [task["percent"] for task in tasks.values() if task.get("percent") is not None]
+    if not percents or len(percents) != len(tasks):
+        return None
+    return round(sum(percents) / len(percents), 1)
+
+
+def run_with_progress(stream, on_progress=None, stage: str = "encode"):
+    # Run an ffmpeg-python output stream with machine-readable progress on stdout,
+    # calling on_progress(snapshot) for every block ffmpeg reports
+    start = time.perf_counter()
+    process = stream.global_args("-progress", "pipe:1", "-nostats").run_async(pipe_stdout=True, pipe_stderr=True)
+
+    stderr_lines = []
+    state = {"duration": None}
+
+    def read_stderr():
+        # Drain stderr so ffmpeg never blocks on a full pipe, and pick up the input duration
+        for raw_line in process.stderr:
+            line = raw_line.decode("utf-8", errors="replace")
+            stderr_lines.append(line)
+            match = DURATION_PATTERN.search(line)
+            if match and state["duration"] is None:
+                hours, minutes, seconds = match.groups()
+                state["duration"] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    stderr_thread = threading.Thread(target=read_stderr, daemon=True)
+    stderr_thread.start()
+
+    fields = {}
+    for raw_line in process.stdout:
+        key, _, value = raw_line.decode("utf-8", errors="replace").strip().partition("=")
+        fields[key] = value
+        if key == "progress":
+            if on_progress is not None:
+                on_progress(parse_progress_block(fields, state["duration"]))
+            fields = {}
+
+    returncode = wait_ffmpeg(process, stage, start)
+    stderr_thread.join()
+    if returncode != 0:
+        raise ffmpeg.Error("ffmpeg", b"", "".join(stderr_lines).encode("utf-8"))
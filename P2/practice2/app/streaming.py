@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+
+from .metrics import bytes_out, wait_ffmpeg
+
+
+STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", 64 * 1024))
+
+MEDIA_TYPES = {"mp4": "video/mp4", "webm": "video/webm"}
+
+
+def streaming_args(container: str):
+    # Output options for containers that can be written to a non-seekable pipe:
+    # MP4 has to be fragmented so the moov box does not need a seek back at the end
+    # (delay_moov lets codecs such as AC3 provide their parameters first)
+    if container == "mp4":
+        return {"format": "mp4", "movflags": "frag_keyframe+empty_moov+default_base_moof+delay_moov"}
+    if container == "webm":
+        return {"format": "webm"}
+    raise HTTPException(status_code=400, detail=f"Unsupported streaming container: {container}")
+
+
+class PipeResponse(StreamingResponse):
+    # Calls `finish` once the response is over, however it ended: a body generator that
+    # never started (client gone before the first chunk) does not run its own finally
+    def __init__(self, content, finish, **kwargs):
+        super().__init__(content, **kwargs)
+        self.finish = finish
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.finish()
+
+
+async def stream_response(output, container: str, cleanup=None, stage: str = "stream"):
+    # Run an ffmpeg-python output node that writes to "pipe:" and send its stdout as a
+    # chunked response while it encodes. `cleanup` runs once ffmpeg is done with its
+    # inputs, whether the stream completes, fails or the client disconnects.
+    start = time.perf_counter()
+    try:
+        process = output.global_args("-loglevel", "error").run_async(pipe_stdout=True, pipe_stderr=True)
+    except BaseException:
+        if cleanup:
+            cleanup()
+        raise
+
+    stderr_lines = []
+    stderr_thread = threading.Thread(target=lambda: stderr_lines.extend(process.stderr), daemon=True)
+    stderr_thread.start()
+
+    finished = []
+    finish_lock = threading.Lock()
+
+    def finish(kill=True):
+        # Reaps ffmpeg and runs `cleanup` only the first time; later calls (the
+        # response closing after the body ended) return the same exit status
+        with finish_lock:
+            if not finished:
+                if kill and process.poll() is None:
+                    process.kill()
+                process.stdout.close()
+                finished.append(wait_ffmpeg(process, stage, start))
+                stderr_thread.join()
+                if cleanup:
+                    cleanup()
+            return finished[0]
+
+    # Wait for the first bytes so errors that happen up front still get a proper status
+    try:
+        first_chunk = await run_in_threadpool(process.stdout.read1, STREAM_CHUNK_SIZE)
+    except BaseException:
+        finish()
+        raise
+    if not first_chunk:
+        finish()
+        error_message = b"".join(stderr_lines).decode("utf-8", errors="replace") or "No output produced"
+        raise HTTPException(status_code=500, detail=f"FFmpeg error: {error_message}")
+
+    def body():
+        completed = False
+        try:
+            bytes_out.inc(len(first_chunk), kind="stream")
+            yield first_chunk
+            while True:
+                chunk = process.stdout.read1(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                bytes_out.inc(len(chunk), kind="stream")
+                yield chunk
+            completed = True
+        finally:
+            # At EOF ffmpeg is finishing on its own: wait for it instead of killing it
+            returncode = finish(kill=not completed)
+        # Headers are already sent, so a late failure can only abort the transfer
+        if completed and returncode != 0:
+            raise RuntimeError(f"ffmpeg exited with status {returncode}: {b''.join(stderr_lines).decode('utf-8', errors='replace')}")
+
+    return PipeResponse(body(), finish, media_type=MEDIA_TYPES[container])
@@ -0,0 +1,138 @@
+import math
+import os
+import threading
+from contextlib import contextmanager
+
+from fastapi import HTTPException
+
+
+supported_codecs = {
+    "vp8": ("libvpx", "webm"),
+    "vp9": ("libvpx-vp9", "webm"),
+    "h265": ("libx265", "mp4"),
+    "av1": ("libaom-av1", "mp4"),
+}
+
+# The encoding ladder writes MP4 renditions with the default H.264 encoder
+LADDER_CODEC = "libx264"
+
+PROFILES = ("realtime", "fast", "balanced", "archival")
+
+# Speed profiles per encoder, fastest first. Each maps to the encoder's own knobs:
+# deadline/cpu-used for libvpx, usage/cpu-used for libaom, presets for x264/x265,
+# plus row-based multithreading and tiling where the encoder supports them.
+ENCODER_PROFILES = {
+    "libvpx": {
+        "realtime": {"deadline": "realtime", "cpu-used": 8},
+        "fast": {"deadline": "good", "cpu-used": 4},
+        "balanced": {"deadline": "good", "cpu-used": 2},
+        "archival": {"deadline": "best", "cpu-used": 0},
+    },
+    "libvpx-vp9": {
+        "realtime": {"deadline": "realtime", "cpu-used": 8, "row-mt": 1, "tile-columns": 2},
+        "fast": {"deadline": "good", "cpu-used": 4, "row-mt": 1, "tile-columns": 2},
+        "balanced": {"deadline": "good", "cpu-used": 2, "row-mt": 1, "tile-columns": 1},
+        "archival": {"deadline": "good", "cpu-used": 0, "row-mt": 1, "tile-columns": 0},
+    },
+    "libaom-av1": {
+        "realtime": {"usage": "realtime", "cpu-used": 8, "row-mt": 1, "tile-columns": 2},
+        "fast": {"usage": "good", "cpu-used": 6, "row-mt": 1, "tile-columns": 2},
+        "balanced": {"usage": "good", "cpu-used": 4, "row-mt": 1, "tile-columns": 1},
+        "archival": {"usage": "good", "cpu-used": 2, "row-mt": 1, "tile-columns": 0},
+    },
+    "libx265": {
+        "realtime": {"preset": "ultrafast", "tune": "zerolatency"},
+        "fast": {"preset": "veryfast"},
+        "balanced": {"preset": "medium"},
+        "archival": {"preset": "slower"},
+    },
+    "libx264": {
+        "realtime": {"preset": "ultrafast", "tune": "zerolatency"},
+        "fast": {"preset": "veryfast"},
+        "balanced": {"preset": "medium"},
+        "archival": {"preset": "slower"},
+    },
+}
+
+# CPU work of each profile relative to the encoder defaults, for admission control
+PROFILE_COSTS = {"realtime": 0.25, "fast": 0.5, "balanced": 1.0, "archival": 3.0}
+
+
+def check_profile(profile: str = None):
+    if profile is not None and profile not in PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown profile: {profile}. Choose one of {', '.join(PROFILES)}")
+
+
+def encoder_args(codec: str, profile: str = None):
+    # No profile keeps the encoder's own defaults
+    if profile is None:
+        return {}
+    return dict(ENCODER_PROFILES.get(codec, {}).get(profile, {}))
+
+
+# Total encoder threads the service may run at once; defaults to every core
+CPU_THREADS = int(os.environ.get("CPU_THREADS", os.cpu_count() or 1))
+
+
+def threading_args(codec: str, threads: int):
+    # Per-encoder threading knobs for a given thread count. Tile columns are log2 and
+    # the encoders clamp them to what the frame width allows.
+    threads = max(1, int(threads))
+    tile_columns = min(int(math.log2(threads)), 6)
+    if codec == "libvpx":
+        return {"threads": threads}
+    if codec in ("libvpx-vp9", "libaom-av1"):
+        return {"threads": threads, "row-mt": 1, "tile-columns": tile_columns}
+    if codec == "libx265":
+        # x265 ignores -threads; its worker pool and frame parallelism are set directly
+        frame_threads = 1 if threads == 1 else min(2 + threads // 8, 6)
+        return {"x265-params": f"pools={threads}:frame-threads={frame_threads}"}
+    return {"threads": threads}
+
+
+def output_args_for(codec: str, profile: str = None, threads: int = None):
+    # Profile settings win over the derived threading defaults (e.g. a profile's tiling)
+    args = threading_args(codec, threads) if threads else {}
+    args.update(encoder_args(codec, profile))
+    return args
+
+
+def check_threads(threads: int = None):
+    if threads is not None and not 1 <= threads <= CPU_THREADS:
+        raise HTTPException(status_code=400, detail=f"Threads must be between 1 and {CPU_THREADS}")
+
+
+class CpuAllocator:
+    # Hands out encoder threads from a fixed budget so simultaneous jobs split the host
+    # instead of each one sizing itself for the whole machine. A job gets a fair share
+    # of the budget for the jobs running alongside it (or the `concurrency` it is
+    # started with), capped by what is still free; threads go back when it finishes.
+    def __init__(self, total: int = CPU_THREADS):
+        self.total = total
+        self.free = total
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, concurrency: int = 1, threads: int = None):
+        with self.lock:
+            self.active += 1
+            if threads is None:
+                threads = max(1, min(self.free, self.total // max(self.active, concurrency, 1)))
+            self.free -= threads
+            return threads
+
+    def release(self, threads: int):
+        with self.lock:
+            self.active -= 1
+            self.free += threads
+
+    @contextmanager
+    def lease(self, concurrency: int = 1, threads: int = None):
+        threads = self.acquire(concurrency, threads)
+        try:
+            yield threads
+        finally:
+            self.release(threads)
+
+
+cpu_allocator = CpuAllocator()
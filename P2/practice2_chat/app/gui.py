@@ -2,7 +2,7 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import requests
 import threading
-import time
+import json
 
 # Función para seleccionar un archivo
 def select_file():
@@ -11,15 +11,27 @@ def select_file():
         entry_file.delete(0, tk.END)
         entry_file.insert(0, file_path)
 
-# Función para manejar el progreso
-def update_progress(progress_bar, duration=5):
-    progress_bar["value"] = 0
-    step = 100 / (duration * 10)
-    for _ in range(duration * 10):
-        time.sleep(0.1)
-        progress_bar["value"] += step
-        root.update_idletasks()
-    progress_bar["value"] = 100
+# Función para mostrar el progreso recibido del servidor
+def show_progress(event):
+    if event.get("percent") is not None:
+        progress_bar["value"] = event["percent"]
+    details = [
+        f"{task}: {info['fps']:.1f} fps, {info['speed']}x"
+        for task, info in event.get("tasks", {}).items()
+        if info.get("speed") is not None
+    ]
+    progress_label.config(text=" | ".join(details))
+
+# Función para seguir el progreso real del trabajo (server-sent events)
+def follow_progress(job_id):
+    event = {}
+    with requests.get(f"http://127.0.0.1:8000/jobs/{job_id}/progress", stream=True) as response:
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data: "):
+                continue
+            event = json.loads(line[len("data: "):])
+            root.after(0, show_progress, event)
+    return event
 
 # Función para enviar datos en un hilo
 def send_request_thread():
@@ -43,31 +55,37 @@ def send_request_thread():
             messagebox.showerror("Error", "Completa los campos de resolución y bitrate.")
             return
 
-        progress_bar.pack(pady=10)  # Mostrar la barra de progreso
+        # Mostrar la barra de progreso
+        progress_bar["value"] = 0
+        progress_label.config(text="")
+        progress_bar.pack(pady=10)
+        progress_label.pack()
 
-        # Simular el progreso (actualízalo acorde con la lógica real del backend)
-        threading.Thread(target=update_progress, args=(progress_bar,)).start()
-
-        # Enviar solicitud
+        # Enviar el trabajo y seguir su progreso
         files = {'file': open(file_path, 'rb')}
         if mode_var.get() == "codec":
             data = {'codecs': selected_codecs}
-            response = requests.post("http://127.0.0.1:8000/convert/", files=files, data=data)
+            response = requests.post("http://127.0.0.1:8000/jobs/convert/", files=files, data=data)
         else:
             data = {'resolutions': [selected_resolution], 'bitrates': [selected_bitrate]}
-            response = requests.post("http://127.0.0.1:8000/encoding-ladder/", files=files, data=data)
+            response = requests.post("http://127.0.0.1:8000/jobs/encoding-ladder/", files=files, data=data)
 
-        if response.status_code == 200:
-            result = response.json()
-            messagebox.showinfo("Éxito", f"Resultado:\n{result}")
-        else:
+        if response.status_code != 202:
             messagebox.showerror("Error", f"Error en la API: {response.json()['detail']}")
+            return
+
+        event = follow_progress(response.json()["job_id"])
+        if event.get("status") == "done":
+            messagebox.showinfo("Éxito", f"Resultado:\n{event['result']}")
+        else:
+            messagebox.showerror("Error", f"Error en el trabajo: {event.get('error')}")
 
     except Exception as e:
         messagebox.showerror("Error", f"Algo salió mal: {str(e)}")
     finally:
         btn_send.config(state="normal")  # Reactivar el botón
         progress_bar.pack_forget()  # Ocultar la barra de progreso
+        progress_label.pack_forget()
 
 # Función para iniciar el hilo
 def start_request():
@@ -136,6 +154,7 @@ btn_send.pack(pady=20)
 
 # Barra de progreso
 progress_bar = ttk.Progressbar(root, orient="horizontal", length=400, mode="determinate")
+progress_label = tk.Label(root, text="")
 
 # Inicializar modo
 toggle_mode()
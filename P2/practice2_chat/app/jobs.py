@@ -0,0 +1,139 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+from fastapi import HTTPException
+
+
+JOBS_DB = os.environ.get("JOBS_DB", "jobs.db")
+JOBS_DIR = os.environ.get("JOBS_DIR", "jobs")  # Uploads waiting for a job live here
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", os.cpu_count() or 1))
+
+
+class JobQueue:
+    # Jobs are persisted in SQLite so that queued and interrupted work is picked
+    # up again after a restart; a thread pool runs the registered handlers.
+    # Live progress is only kept in memory, per job and per task.
+    def __init__(self, db_path: str = JOBS_DB, workers: int = JOB_WORKERS):
+        self.db_path = db_path
+        self.handlers = {}
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.progress = {}
+        self.progress_lock = threading.Lock()
+
+    def open(self):
+        # Creates the database on first use; called from the app's startup hook so that
+        # importing the module does not write anything to the working directory
+        with closing(self._connect()) as db, db:
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _update(self, job_id: str, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with closing(self._connect()) as db, db:
+            db.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def register(self, kind: str, handler):
+        self.handlers[kind] = handler
+
+    def submit(self, kind: str, params: dict) -> str:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "INSERT INTO jobs (id, kind, params, status, created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, kind, json.dumps(params), now, now),
+            )
+
+        self.executor.submit(self._run, job_id)
+        return job_id
+
+    def resume(self):
+        # Anything still queued or running belongs to a previous process: run it again
+        with closing(self._connect()) as db, db:
+            rows = db.execute("SELECT id FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at").fetchall()
+            db.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+
+        for (job_id,) in rows:
+            self.executor.submit(self._run, job_id)
+
+    def pending(self):
+        # Parameters of the jobs that resume() would run again
+        with closing(self._connect()) as db:
+            rows = db.execute("SELECT params FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+        return [json.loads(params) for (params,) in rows]
+
+    def get(self, job_id: str):
+        with closing(self._connect()) as db:
+            row = db.execute(
+                "SELECT id, kind, status, result, error, created_at, updated_at FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        job_id, kind, status, result, error, created_at, updated_at = row
+        return {
+            "job_id": job_id,
+            "kind": kind,
+            "status": status,
+            "result": json.loads(result) if result else None,
+            "error": error,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    def counts(self):
+        # Number of jobs in each status, e.g. how many are still queued
+        with closing(self._connect()) as db:
+            return dict(db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def report(self, job_id: str, task: str, snapshot: dict):
+        with self.progress_lock:
+            self.progress.setdefault(job_id, {})[task] = snapshot
+
+    def get_progress(self, job_id: str):
+        with self.progress_lock:
+            return dict(self.progress.get(job_id, {}))
+
+    def _run(self, job_id: str):
+        with closing(self._connect()) as db:
+            kind, params = db.execute("SELECT kind, params FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+        self._update(job_id, status="running")
+        try:
+            progress = lambda task, snapshot: self.report(job_id, task, snapshot)
+            result = self.handlers[kind](json.loads(params), progress)
+            self._update(job_id, status="done", result=json.dumps(result))
+        except HTTPException as e:
+            self._update(job_id, status="failed", error=str(e.detail))
+        except Exception as e:
+            self._update(job_id, status="failed", error=str(e))
+        finally:
+            with self.progress_lock:
+                self.progress.pop(job_id, None)
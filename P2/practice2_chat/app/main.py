@@ -1,86 +1,399 @@
 from typing import Union, List
 from fastapi import FastAPI, UploadFile, File, HTTPException, Form
-from fastapi.responses import FileResponse
-import tempfile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse, Response
 import os
 import ffmpeg
 from pydantic import BaseModel
 import shutil
+import asyncio
+import time
+import json
+import uuid
+from concurrent.futures import wait
 
+from .ingest import save_upload
+from .jobs import JobQueue, JOBS_DIR
+from .progress import run_with_progress, overall_percent
+from .cache import ResultCache
+from .probe import ProbeCache, ProbeResult
+from .segments import chunked_encode, SEGMENT_WORKERS
+from .streaming import stream_response, streaming_args
+from .encoders import (
+    supported_codecs,
+    LADDER_CODEC,
+    check_profile,
+    check_threads,
+    cpu_allocator,
+    output_args_for,
+    PROFILE_COSTS,
+)
+from .scheduler import scheduler, estimate_cost, combine_costs, check_priority, FREE
+from .metrics import registry, Gauge, CONTENT_TYPE, timed, record_output
+
+
+# Encodes run on the scheduler's workers: it admits them against the CPU/memory
+# budget, so a burst of requests queues instead of starting every encoder at once.
+
+MAX_SEGMENTS = int(os.environ.get("MAX_SEGMENTS", 64))
+
+output_directory = "/app"  # C:\Users\Usuari\Documents\UNI\Video_Coding\P2
+
+
+AUDIO_ARGS = {"acodec": "libopus", "ac": 2}  # Fuerza el audio a ser estéreo
 
 
 class Translator:
     @staticmethod
-    def convert_video(codec: str, input_path: str, output_path: str, container: str):
+    def convert_command(codec: str, input_path: str, output_path: str, **output_args):
+        return ffmpeg.input(input_path).output(output_path, vcodec=codec, **AUDIO_ARGS, **output_args)
+
+    @staticmethod
+    def convert_video(codec: str, input_path: str, output_path: str, container: str, progress=None, segments: int = 1, profile: str = None, threads: int = None):
+        output_args = output_args_for(codec, profile, threads)
         try:
-            ffmpeg.input(input_path).output(
-                output_path,
-                vcodec=codec,
-                acodec="libopus",
-                ac=2,  # Fuerza el audio a ser estéreo
-                format=container,
-            ).overwrite_output().run()
+            # Long encodes can be split at keyframes and run as parallel segments, which
+            # share this encode's threads between them
+            segment_threads = max(1, threads // min(segments, SEGMENT_WORKERS)) if threads else None
+            if segments > 1 and chunked_encode(
+                codec, input_path, output_path, container, segments,
+                output_args_for(codec, profile, segment_threads), AUDIO_ARGS, progress,
+            ):
+                return output_path
+
+            stream = Translator.convert_command(
+                codec, input_path, output_path, format=container, **output_args
+            ).overwrite_output()
+            run_with_progress(stream, progress, "convert")
             return output_path
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Video conversion failed: {str(e)}")
 
+    @staticmethod
+    def timed_convert_video(codec: str, input_path: str, output_path: str, container: str, progress=None, segments: int = 1, profile: str = None, threads: int = None):
+        start = time.perf_counter()
+        Translator.convert_video(codec, input_path, output_path, container, progress, segments, profile, threads)
+        return output_path, time.perf_counter() - start
+
+    @staticmethod
+    def encoding_ladder(input_path: str, rungs: List[tuple], progress=None, profile: str = None, threads: int = None):
+        # Decode the source once and split it into one scaler/encoder branch per rung
+        rung_threads = max(1, threads // len(rungs)) if threads else None
+        try:
+            split = ffmpeg.input(input_path).video.filter_multi_output('split', len(rungs))
+            outputs = [
+                split.stream(i).filter('scale', width, height).output(
+                    output_path,
+                    vcodec=LADDER_CODEC,
+                    video_bitrate=bitrate,
+                    format='mp4',
+                    **output_args_for(LADDER_CODEC, profile, rung_threads)
+                )
+                for i, (width, height, bitrate, output_path) in enumerate(rungs)
+            ]
+            run_with_progress(ffmpeg.merge_outputs(*outputs).overwrite_output(), progress, "encoding_ladder")
+            return [output_path for _, _, _, output_path in rungs]
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Encoding ladder failed: {str(e)}")
+
+
+def output_path_for(filename: str, suffix: str):
+    return os.path.join(output_directory, f"{os.path.splitext(filename)[0]}{suffix}")
+
+
+def partial_path_for(path: str):
+    # A private name next to `path` to write into before os.replace moves it in place, so
+    # encodes that target the same output (a repeated upload name) never share a file
+    root, extension = os.path.splitext(path)
+    return f"{root}.{uuid.uuid4().hex}.partial{extension}"
+
+
+def remove_file(path: str):
+    with timed("cleanup"):
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+def remover(path: str):
+    def remove():
+        remove_file(path)
+    return remove
+
+
+def check_codecs(codecs: List[str]):
+    # Returns the codecs without repeats (case-insensitive), in the order first given
+    invalid_codecs = [codec for codec in codecs if codec.lower() not in supported_codecs]
+    if invalid_codecs:
+        raise HTTPException(status_code=400, detail=f"Unsupported codecs: {', '.join(invalid_codecs)}")
+    unique = {}
+    for codec in codecs:
+        unique.setdefault(codec.lower(), codec)
+    return list(unique.values())
+
+
+def check_segments(segments: int):
+    if not 1 <= segments <= MAX_SEGMENTS:
+        raise HTTPException(status_code=400, detail=f"Segments must be between 1 and {MAX_SEGMENTS}")
+
+
+def convert_with_cache(cache_key: str, codec: str, input_path: str, output_path: str, container: str, progress=None, segments: int = 1, profile: str = None, threads: int = None, concurrency: int = 1):
+    partial_path = partial_path_for(output_path)
+    try:
+        if cache.get(cache_key, partial_path):
+            elapsed, status = 0.0, "hit"
+        else:
+            # Threads come out of the shared budget unless the caller pinned a count
+            with cpu_allocator.lease(concurrency, threads) as granted:
+                _, elapsed = Translator.timed_convert_video(
+                    codec, input_path, partial_path, container, progress, segments, profile, granted
+                )
+            cache.put(cache_key, partial_path)
+            status = "miss"
+        os.replace(partial_path, output_path)
+    finally:
+        remove_file(partial_path)
+    record_output(output_path)
+    return output_path, elapsed, status
+
+
+def encode_cost(info: ProbeResult, codec: str, profile: str = None, threads: int = None, segments: int = 1, **kwargs):
+    # Pinned threads or parallel segments decide how many cores the encode keeps busy
+    cores = threads or (min(segments, SEGMENT_WORKERS) if segments > 1 else None)
+    return estimate_cost(info, codec, factor=PROFILE_COSTS.get(profile, 1.0), cores=cores, **kwargs)
+
+
+def submit_conversions(input_path: str, input_hash: str, filename: str, codecs: List[str], info: ProbeResult,
+                       progress=None, segments: int = 1, profile: str = None, threads: int = None,
+                       priority: str = "normal", force: bool = False):
+    # Queue one ffmpeg job per codec on the scheduler, reporting progress under the codec name
+    items = []
+    for codec in codecs:
+        codec_name, container = supported_codecs[codec.lower()]
+        output_path = output_path_for(filename, f".{codec.lower()}.{container}")
+        params = {"codec": codec.lower()}
+        if segments > 1:
+            params["segments"] = segments  # keyframe placement differs from a single-pass encode
+        if profile is not None:
+            params["profile"] = profile
+        cache_key = ResultCache.key(input_hash, "convert", params)
+        codec_progress = (lambda snapshot, codec=codec: progress(codec, snapshot)) if progress else None
+        # Cached results cost nothing and are not held back by encodes in the queue
+        cost = FREE if cache_key in cache else encode_cost(info, codec_name, profile, threads, segments)
+        items.append((cost, convert_with_cache, (
+            cache_key, codec_name, input_path, output_path, container, codec_progress,
+            segments, profile, threads, len(codecs),
+        )))
+    return scheduler.submit_all(items, priority, force)
+
+
+def conversion_results(codecs: List[str], results: list):
+    output_files = {}
+    timings = {}
+    cache_status = {}
+    for codec, (output_path, elapsed, status) in zip(codecs, results):
+        output_files[codec] = output_path
+        timings[codec] = round(elapsed, 3)
+        cache_status[codec] = status
+    return {"converted_files": output_files, "timings": timings, "cache": cache_status}
+
+
+def ladder_rungs(filename: str, resolutions: List[str], bitrates: List[int]):
+    output_files = {}
+    rungs = []
+    for resolution, bitrate in zip(resolutions, bitrates):
+        output_path = output_path_for(filename, f".{resolution}.mp4")
+        width, height = resolution.split('x')
+        rungs.append((width, height, bitrate, output_path))
+        output_files[resolution] = output_path
+    return rungs, output_files
+
+
+def ladder_key(input_hash: str, width, height, bitrate, profile: str = None):
+    params = {"width": int(width), "height": int(height), "bitrate": int(bitrate)}
+    if profile is not None:
+        params["profile"] = profile
+    return ResultCache.key(input_hash, "encoding-ladder", params)
+
+
+def ladder_cost(info: ProbeResult, input_hash: str, rungs: List[tuple], profile: str = None):
+    # Every rung still to encode is an output of the same ffmpeg run
+    return combine_costs(
+        encode_cost(info, LADDER_CODEC, profile, width=int(width), height=int(height))
+        for width, height, bitrate, _ in rungs
+        if ladder_key(input_hash, width, height, bitrate, profile) not in cache
+    )
+
+
+def ladder_with_cache(input_path: str, input_hash: str, rungs: List[tuple], progress=None, profile: str = None, threads: int = None):
+    # Serve the rungs we already have from the cache and encode only the rest
+    statuses = []
+    missing = []
+    partial_paths = [partial_path_for(output_path) for _, _, _, output_path in rungs]
+    try:
+        for (width, height, bitrate, _), partial_path in zip(rungs, partial_paths):
+            cache_key = ladder_key(input_hash, width, height, bitrate, profile)
+            if cache.get(cache_key, partial_path):
+                statuses.append("hit")
+            else:
+                statuses.append("miss")
+                missing.append((cache_key, (width, height, bitrate, partial_path)))
+
+        if missing:
+            with cpu_allocator.lease(1, threads) as granted:
+                Translator.encoding_ladder(input_path, [rung for _, rung in missing], progress, profile, granted)
+            for cache_key, (_, _, _, partial_path) in missing:
+                cache.put(cache_key, partial_path)
+        for (_, _, _, output_path), partial_path in zip(rungs, partial_paths):
+            os.replace(partial_path, output_path)
+    finally:
+        for partial_path in partial_paths:
+            remove_file(partial_path)
+    for _, _, _, output_path in rungs:
+        record_output(output_path)
+    return statuses
+
+
+# Background job handlers: they own the spooled input and remove it when done
+# Accepted jobs are never refused by the scheduler, only queued behind other work
+def convert_job(params: dict, progress):
+    try:
+        with scheduler.claim(params.get("reserved", 0)):
+            info = probes.probe(params["input_path"], params["sha256"])
+            futures = submit_conversions(
+                params["input_path"], params["sha256"], params["filename"], params["codecs"], info, progress,
+                params.get("segments", 1), params.get("profile"), params.get("threads"),
+                params.get("priority", "normal"), force=True,
+            )
+        wait(futures)
+        return conversion_results(params["codecs"], [future.result() for future in futures])
+    finally:
+        remove_file(params["input_path"])
+
+
+def ladder_job(params: dict, progress):
+    try:
+        rungs, output_files = ladder_rungs(params["filename"], params["resolutions"], params["bitrates"])
+        with scheduler.claim(params.get("reserved", 0)):
+            info = probes.probe(params["input_path"], params["sha256"])
+            cost = ladder_cost(info, params["sha256"], rungs, params.get("profile"))
+            future = scheduler.submit(
+                cost, ladder_with_cache,
+                params["input_path"], params["sha256"], rungs, lambda snapshot: progress("ladder", snapshot),
+                params.get("profile"), params.get("threads"),
+                priority=params.get("priority", "normal"), force=True,
+            )
+        statuses = future.result()
+        return {"ladder_files": output_files, "cache": dict(zip(output_files, statuses))}
+    finally:
+        remove_file(params["input_path"])
+
+
+cache = ResultCache()
+
+probes = ProbeCache()
+
+jobs = JobQueue()
+jobs.register("convert", convert_job)
+jobs.register("encoding-ladder", ladder_job)
+
+registry.register(Gauge(
+    "video_jobs", "Background jobs by status.",
+    lambda: [({"status": status}, count) for status, count in sorted(jobs.counts().items())],
+))
+
 
 
 app = FastAPI()
 
 
+@app.on_event("startup")
+def resume_jobs():
+    cache.open()
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    jobs.open()
+    # Resumed jobs hold their queue slots again, as they did when first accepted
+    scheduler.reserve(sum(params.get("reserved", 0) for params in jobs.pending()), force=True)
+    jobs.resume()
+
+
 @app.get("/")
 async def root():
     return {"message": "Welcome"}
 
 
+@app.get("/metrics")
+async def metrics():
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
+
 
 @app.post("/convert/")
 async def convert(
     codecs: List[str] = Form(...),
     file: UploadFile = File(...),
+    segments: int = Form(1),
+    stream: bool = Form(False),
+    profile: Union[str, None] = Form(None),
+    threads: Union[int, None] = Form(None),
+    priority: str = Form("normal"),
 ):
 
-    output_directory = "/app"  # C:\Users\Usuari\Documents\UNI\Video_Coding\P2
-    
-    supported_codecs = {
-        "vp8": ("libvpx", "webm"),
-        "vp9": ("libvpx-vp9", "webm"),
-        "h265": ("libx265", "mp4"),
-        "av1": ("libaom-av1", "mp4"),
-    }
-    
-    invalid_codecs = [codec for codec in codecs if codec.lower() not in supported_codecs]
-    if invalid_codecs:
-        raise HTTPException(status_code=400, detail=f"Unsupported codecs: {', '.join(invalid_codecs)}")
+    codecs = check_codecs(codecs)
+    check_segments(segments)
+    check_profile(profile)
+    check_threads(threads)
+    check_priority(priority)
+
+    # Streaming sends one encode back in the response instead of writing it under /app
+    if stream:
+        if len(codecs) != 1 or segments != 1:
+            raise HTTPException(status_code=400, detail="Streaming supports a single codec without segments")
+        codec_name, container = supported_codecs[codecs[0].lower()]
+        upload = await save_upload(file)
+        try:
+            info = await run_in_threadpool(probes.probe, upload.path, upload.sha256)
+            cost = encode_cost(info, codec_name, profile, threads)
+        except BaseException:
+            remove_file(upload.path)
+            raise
+        release = await scheduler.lease(cost, priority, cleanup=remover(upload.path))
+        granted = cpu_allocator.acquire(1, threads)
+
+        def cleanup():
+            cpu_allocator.release(granted)
+            release()
+
+        command = Translator.convert_command(
+            codec_name, upload.path, "pipe:", **streaming_args(container), **output_args_for(codec_name, profile, granted)
+        )
+        return await stream_response(command, container, cleanup=cleanup, stage="convert")
     
+    input_path = None
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_input:
-            temp_input.write(await file.read())
-            input_path = temp_input.name
-
-        output_files = {}
-        for codec in codecs:
-            codec_name, container = supported_codecs[codec.lower()]
-            output_suffix = f".{codec.lower()}.{container}"
-            output_path = os.path.join(output_directory, f"{os.path.splitext(file.filename)[0]}{output_suffix}")
-            
-            Translator.convert_video(
-                codec=codec_name,
-                input_path=input_path,
-                output_path=output_path,
-                container=container,
-            )
-            output_files[codec] = output_path
-        
-        return {"converted_files": output_files}
+        upload = await save_upload(file)
+        input_path = upload.path
+
+        info = await run_in_threadpool(probes.probe, input_path, upload.sha256)
+        futures = submit_conversions(
+            input_path, upload.sha256, file.filename, codecs, info,
+            segments=segments, profile=profile, threads=threads, priority=priority,
+        )
+
+        # Let every encode finish before the input is removed, then surface the first failure
+        results = await asyncio.gather(*(asyncio.wrap_future(future) for future in futures), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+        return conversion_results(codecs, results)
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"File processing failed: {str(e)}")
     
     finally:
-        if os.path.exists(input_path):
-            os.remove(input_path)
+        remove_file(input_path)
 
 
 
@@ -90,37 +403,141 @@ async def convert(
 async def encoding_ladder(
     file: UploadFile = File(...),
     resolutions: List[str] = Form(...),
-    bitrates: List[int] = Form(...)
+    bitrates: List[int] = Form(...),
+    profile: Union[str, None] = Form(None),
+    threads: Union[int, None] = Form(None),
+    priority: str = Form("normal"),
 ):
 
     if len(resolutions) != len(bitrates):
         raise HTTPException(status_code=400, detail="Resolutions and bitrates must match.")
+    check_profile(profile)
+    check_threads(threads)
+    check_priority(priority)
     
+    input_path = None
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_input:
-            temp_input.write(await file.read())
-            input_path = temp_input.name
-
-        output_directory = "/app"
-        output_files = {}
-
-        for resolution, bitrate in zip(resolutions, bitrates):
-            output_suffix = f".{resolution}.mp4"
-            output_path = os.path.join(output_directory, f"{os.path.splitext(file.filename)[0]}{output_suffix}")
-            
-            ffmpeg.input(input_path).filter('scale', resolution.split('x')[0], resolution.split('x')[1]).output(
-                output_path,
-                video_bitrate=bitrate,
-                format='mp4'
-            ).overwrite_output().run()
-
-            output_files[resolution] = output_path
-
-        return {"ladder_files": output_files}
+        upload = await save_upload(file)
+        input_path = upload.path
+
+        rungs, output_files = ladder_rungs(file.filename, resolutions, bitrates)
+
+        info = await run_in_threadpool(probes.probe, input_path, upload.sha256)
+        statuses = await scheduler.run(
+            ladder_cost(info, upload.sha256, rungs, profile), ladder_with_cache,
+            input_path, upload.sha256, rungs, None, profile, threads, priority=priority,
+        )
+
+        return {"ladder_files": output_files, "cache": dict(zip(output_files, statuses))}
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating encoding ladder: {str(e)}")
 
     finally:
-        if os.path.exists(input_path):
-            os.remove(input_path)
+        remove_file(input_path)
+
+
+async def submit_job(kind: str, file: UploadFile, slots: int, params: dict):
+    # The job's scheduler tasks are counted against the queue from now on, not only once
+    # a worker picks it up, so a burst of jobs is refused like a burst of direct requests
+    scheduler.reserve(slots)
+    try:
+        upload = await save_upload(file, directory=JOBS_DIR)
+        return jobs.submit(kind, {"input_path": upload.path, "sha256": upload.sha256, "reserved": slots, **params})
+    except BaseException:
+        scheduler.unreserve(slots)
+        raise
+
+
+@app.post("/jobs/convert/", status_code=202)
+async def submit_convert(
+    codecs: List[str] = Form(...),
+    file: UploadFile = File(...),
+    segments: int = Form(1),
+    profile: Union[str, None] = Form(None),
+    threads: Union[int, None] = Form(None),
+    priority: str = Form("normal"),
+):
+    codecs = check_codecs(codecs)
+    check_segments(segments)
+    check_profile(profile)
+    check_threads(threads)
+    check_priority(priority)
+
+    job_id = await submit_job("convert", file, len(codecs), {
+        "filename": file.filename,
+        "codecs": codecs,
+        "segments": segments,
+        "profile": profile,
+        "threads": threads,
+        "priority": priority,
+    })
+    return {"job_id": job_id, "status": "queued"}
+
+
+@app.post("/jobs/encoding-ladder/", status_code=202)
+async def submit_encoding_ladder(
+    file: UploadFile = File(...),
+    resolutions: List[str] = Form(...),
+    bitrates: List[int] = Form(...),
+    profile: Union[str, None] = Form(None),
+    threads: Union[int, None] = Form(None),
+    priority: str = Form("normal"),
+):
+    if len(resolutions) != len(bitrates):
+        raise HTTPException(status_code=400, detail="Resolutions and bitrates must match.")
+    check_profile(profile)
+    check_threads(threads)
+    check_priority(priority)
+
+    job_id = await submit_job("encoding-ladder", file, 1, {
+        "filename": file.filename,
+        "resolutions": resolutions,
+        "bitrates": bitrates,
+        "profile": profile,
+        "threads": threads,
+        "priority": priority,
+    })
+    return {"job_id": job_id, "status": "queued"}
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job
+
+
+@app.get("/jobs/{job_id}/progress")
+async def job_progress(job_id: str):
+    if jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+
+    async def events():
+        # Server-sent events: one message whenever the job's progress changes, until it ends
+        last_event = None
+        while True:
+            job = jobs.get(job_id)
+            tasks = jobs.get_progress(job_id)
+            finished = job["status"] in ("done", "failed")
+
+            event = {
+                "status": job["status"],
+                "percent": 100.0 if job["status"] == "done" else overall_percent(tasks),
+                "tasks": tasks,
+            }
+            if finished:
+                event.update(result=job["result"], error=job["error"])
+
+            if event != last_event:
+                yield f"data: {json.dumps(event)}\n\n"
+                last_event = event
+
+            if finished:
+                break
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
@@ -0,0 +1,144 @@
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import ffmpeg
+
+from .metrics import run_ffmpeg, timed
+from .progress import run_with_progress
+
+
+# Segments get their own pool: they are submitted from encodes that already hold a
+# scheduler worker, and sharing it could deadlock once every worker is waiting.
+SEGMENT_WORKERS = int(os.environ.get("SEGMENT_WORKERS", os.cpu_count() or 1))
+segment_executor = ThreadPoolExecutor(max_workers=SEGMENT_WORKERS)
+
+
+def keyframe_times(input_path: str):
+    # Keyframe timestamps of the first video stream, read from packet flags (no decoding)
+    probe = ffmpeg.probe(input_path, select_streams="v:0", show_entries="packet=pts_time,flags")
+    times = sorted(
+        float(packet["pts_time"])
+        for packet in probe.get("packets", [])
+        if "K" in packet.get("flags", "") and packet.get("pts_time") not in (None, "N/A")
+    )
+    duration = float(probe.get("format", {}).get("duration") or 0)
+    return times, duration
+
+
+def split_points(keyframes: list, duration: float, segments: int):
+    # Pick the keyframe closest to each ideal boundary so segments come out about even
+    points = []
+    for i in range(1, segments):
+        target = duration * i / segments
+        candidates = [time for time in keyframes if time > (points[-1] if points else 0)]
+        if not candidates:
+            break
+        point = min(candidates, key=lambda time: abs(time - target))
+        if point < duration:
+            points.append(point)
+    return sorted(set(points))
+
+
+def split_video(input_path: str, points: list, work_dir: str):
+    # Stream-copy the video at the chosen keyframes, so splitting costs almost nothing
+    pattern = os.path.join(work_dir, "source_%05d.mkv")
+    run_ffmpeg(ffmpeg.input(input_path).video.output(
+        pattern,
+        vcodec="copy",
+        format="segment",
+        segment_times=",".join(f"{point:.6f}" for point in points),
+        reset_timestamps=1,
+    ).overwrite_output(), "split_segments")
+    return sorted(
+        os.path.join(work_dir, name) for name in os.listdir(work_dir) if name.startswith("source_")
+    )
+
+
+def encode_segment(codec: str, segment_path: str, output_path: str, output_args: dict, progress=None):
+    # Every segment gets the same encoder arguments so the pieces concatenate cleanly
+    stream = ffmpeg.input(segment_path).video.output(output_path, vcodec=codec, format="matroska", **output_args)
+    run_with_progress(stream.overwrite_output(), progress, "encode_segment")
+    return output_path
+
+
+def join_segments(segment_paths: list, input_path: str, output_path: str, container: str, audio_args: dict):
+    # Concatenate the encoded video losslessly and encode the audio once from the source
+    list_path = os.path.join(os.path.dirname(segment_paths[0]), "segments.txt")
+    with open(list_path, "w") as f:
+        f.writelines(f"file '{path}'\n" for path in segment_paths)
+
+    video = ffmpeg.input(list_path, format="concat", safe=0).video
+    audio = ffmpeg.input(input_path)["a?"]
+    run_ffmpeg(
+        ffmpeg.output(video, audio, output_path, vcodec="copy", format=container, **audio_args).overwrite_output(),
+        "join_segments",
+    )
+    return output_path
+
+
+def segment_progress(durations: list, progress):
+    # Merge per-segment reports into one snapshot covering the whole file
+    if progress is None:
+        return [None] * len(durations)
+
+    total = sum(durations)
+    done = [0.0] * len(durations)
+    frames = [0] * len(durations)
+    lock = threading.Lock()
+
+    def reporter(index):
+        def report(snapshot):
+            with lock:
+                done[index] = durations[index] if snapshot["finished"] else min(snapshot["out_time"], durations[index])
+                frames[index] = snapshot["frame"]
+                out_time = sum(done)
+                progress({
+                    "frame": sum(frames),
+                    "fps": None,
+                    "speed": None,
+                    "out_time": round(out_time, 3),
+                    "duration": total,
+                    "percent": round(min(out_time / total, 1.0) * 100, 1) if total else None,
+                    "finished": all(done[i] >= durations[i] for i in range(len(durations))),
+                })
+        return report
+
+    return [reporter(index) for index in range(len(durations))]
+
+
+def chunked_encode(codec: str, input_path: str, output_path: str, container: str, segments: int,
+                   output_args: dict = None, audio_args: dict = None, progress=None):
+    # Split at keyframes, encode the segments in parallel and join them back with the
+    # concat demuxer. Returns False when the source has too few keyframes to split.
+    keyframes, duration = keyframe_times(input_path)
+    points = split_points(keyframes, duration, segments)
+    if not points:
+        return False
+
+    work_dir = tempfile.mkdtemp(prefix="segments_", dir=os.path.dirname(output_path) or None)
+    try:
+        sources = split_video(input_path, points, work_dir)
+        bounds = [0.0] + points + [duration]
+        reporters = segment_progress([end - start for start, end in zip(bounds, bounds[1:])], progress)
+
+        futures = [
+            segment_executor.submit(
+                encode_segment, codec, source, os.path.join(work_dir, f"encoded_{index:05d}.mkv"),
+                output_args or {}, reporter,
+            )
+            for index, (source, reporter) in enumerate(zip(sources, reporters))
+        ]
+        # Wait for every segment before cleaning up, then surface the first failure
+        encoded = [future.exception() or future.result() for future in futures]
+        for result in encoded:
+            if isinstance(result, BaseException):
+                raise result
+
+        join_segments(encoded, input_path, output_path, container, audio_args or {})
+        return True
+    finally:
+        with timed("cleanup"):
+            shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+from functools import lru_cache
+
+
+CACHE_DIR = os.environ.get("CACHE_DIR", "cache")
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", 20 * 1024 ** 3))  # 20 GiB
+
+
+@lru_cache(maxsize=None)
+def ffmpeg_version():
+    # Outputs from a different ffmpeg build must not be served from the cache
+    try:
+        output = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True).stdout
+        return output.splitlines()[0] if output else "unknown"
+    except OSError:
+        return "unknown"
+
+
+class ResultCache:
+    # Content-addressed store of encoded outputs on local disk. Entries are keyed on
+    # the input hash, the operation, its normalized parameters and the ffmpeg
+    # version, and the least recently used ones are evicted above max_bytes.
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> size, least recently used first
+        self.total_bytes = 0
+        self.pins = Counter()  # key -> copies in progress; pinned entries are not evicted
+
+    def open(self):
+        # Creates the directory and indexes what is already there; called from the app's
+        # startup hook so that importing the module does not write to the working directory
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isfile(path) and not name.startswith("."):
+                stat = os.stat(path)
+                found.append((stat.st_mtime, name, stat.st_size))
+        with self.lock:
+            self.entries = OrderedDict((key, size) for _, key, size in sorted(found))
+            self.total_bytes = sum(self.entries.values())
+
+    @staticmethod
+    def key(input_hash: str, operation: str, params: dict):
+        payload = json.dumps(
+            {"input": input_hash, "operation": operation, "params": params, "ffmpeg": ffmpeg_version()},
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str):
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key: str):
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key: str, destination: str):
+        # Copy a cached artifact to destination; returns False on a miss. The entry is
+        # pinned so it cannot be evicted meanwhile, and the copy runs outside the lock so
+        # a large hit does not hold up every other lookup.
+        with self.lock:
+            if key not in self.entries:
+                return False
+            self.entries.move_to_end(key)
+            self.pins[key] += 1
+
+        try:
+            path = self._path(key)
+            os.utime(path)
+
+            destination_dir = os.path.dirname(destination)
+            if destination_dir:
+                os.makedirs(destination_dir, exist_ok=True)
+            shutil.copyfile(path, destination)
+        finally:
+            with self.lock:
+                self.pins[key] -= 1
+                if not self.pins[key]:
+                    del self.pins[key]
+        return True
+
+    def put(self, key: str, source: str):
+        # Write to a hidden temp file first so a half-copied entry is never served
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix=".")
+        os.close(fd)
+        shutil.copyfile(source, temp_path)
+        size = os.path.getsize(temp_path)
+
+        with self.lock:
+            os.replace(temp_path, self._path(key))
+            self.total_bytes += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+
+            # Least recently used first, skipping the new entry and any being copied out
+            candidates = [name for name in self.entries if name != key and name not in self.pins]
+            for evicted in candidates:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self.total_bytes -= self.entries.pop(evicted)
+                if os.path.exists(self._path(evicted)):
+                    os.remove(self._path(evicted))
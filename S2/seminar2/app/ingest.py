@@ -0,0 +1,50 @@
+import hashlib
+import os
+import tempfile
+import time
+from typing import NamedTuple
+
+from fastapi import HTTPException, UploadFile
+
+from .metrics import bytes_in, stage_seconds
+
+
+CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 1024 * 1024))  # 1 MiB
+MAX_UPLOAD_SIZE = int(os.environ.get("MAX_UPLOAD_SIZE", 8 * 1024 ** 3))  # 8 GiB
+
+
+class Upload(NamedTuple):
+    path: str
+    sha256: str
+    size: int
+
+
+async def save_upload(file: UploadFile, directory: str = None, max_size: int = MAX_UPLOAD_SIZE) -> Upload:
+    # Stream the upload to a temp file in fixed-size blocks so memory use does not
+    # depend on the file size, hashing it on the way through
+    start = time.perf_counter()
+    fd, path = tempfile.mkstemp(suffix=f"_{os.path.basename(file.filename or 'upload')}", dir=directory)
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                size += len(chunk)
+                if size > max_size:
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds the maximum size of {max_size} bytes")
+
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+    bytes_in.inc(size)
+    stage_seconds.observe(time.perf_counter() - start, stage="upload")
+    return Upload(path=path, sha256=digest.hexdigest(), size=size)
@@ -1,15 +1,36 @@
 from typing import Union, List
 from fastapi import FastAPI, UploadFile, File, HTTPException, Form
-from fastapi.responses import FileResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response
 import tempfile
 import os
+import shutil
 import ffmpeg
 from pydantic import BaseModel
 from typing import List
 from collections import Counter
 
+from .ingest import save_upload
+from .jobs import JobQueue, JOBS_DIR
+from .cache import ResultCache
+from .probe import ProbeCache, ProbeResult
+from .streaming import stream_response, streaming_args
+from .scheduler import scheduler, estimate_cost, check_priority
+from .metrics import registry, Gauge, CONTENT_TYPE, run_ffmpeg, timed, record_output
+
 
 class Translator:
+    # The *_command builders return the ffmpeg graph for an operation, so the same graph
+    # can be run to a file or streamed from "pipe:" (see streaming.py)
+    @staticmethod
+    def resize_command(scale_factor: float, input_path: str, output_path: str, **output_args):
+        return (
+            ffmpeg
+            .input(input_path)
+            .filter('scale', f"iw/{scale_factor}", f"ih/{scale_factor}")
+            .output(output_path, **output_args)
+        )
+
     @staticmethod
     def vid_resize(scale_factor: float, input_path: str, output_path: str):
         
@@ -19,13 +40,7 @@ class Translator:
         
         # Use ffmpeg to resize the video
         try:
-            (
-                ffmpeg
-                .input(input_path)
-                .filter('scale', f"iw/{scale_factor}", f"ih/{scale_factor}")
-                .output(output_path)
-                .run(overwrite_output=True)
-            )
+            run_ffmpeg(Translator.resize_command(scale_factor, input_path, output_path).overwrite_output(), "resize")
         except ffmpeg.Error as e:
             error_message = e.stderr.decode("utf-8")
             raise HTTPException(status_code=500, detail=f"FFmpeg error: {error_message}")
@@ -33,7 +48,7 @@ class Translator:
         return output_path
     
     @staticmethod
-    def vid_modify_chroma_subsampling(input_path: str, output_path: str, subsampling: str):
+    def chroma_command(input_path: str, output_path: str, subsampling: str, info: ProbeResult = None, **output_args):
         subsampling_map = {
             "4:4:4": "yuv444p",
             "4:2:2": "yuv422p",
@@ -43,15 +58,18 @@ class Translator:
         if subsampling not in subsampling_map:
             raise HTTPException(status_code=400, detail=f"Invalid chroma subsampling: {subsampling}")
         
-        pix_fmt = subsampling_map[subsampling]
+        if info is not None and info.video is None:
+            raise HTTPException(status_code=400, detail="No video stream found")
         
+        pix_fmt = subsampling_map[subsampling]
+        output_args = {"format": "mp4", **output_args}
+        return ffmpeg.input(input_path).output(output_path, pix_fmt=pix_fmt, vcodec='libx264', acodec='aac', **output_args)
+
+    @staticmethod
+    def vid_modify_chroma_subsampling(input_path: str, output_path: str, subsampling: str, info: ProbeResult = None):
+        command = Translator.chroma_command(input_path, output_path, subsampling, info)
         try:
-            (
-                ffmpeg
-                .input(input_path)
-                .output(output_path, pix_fmt=pix_fmt, vcodec='libx264', acodec='aac', format='mp4')
-                .run(overwrite_output=True)
-            )
+            run_ffmpeg(command.overwrite_output(), "modify_chroma")
         except ffmpeg.Error as e:
             error_message = e.stderr.decode("utf-8")
             raise HTTPException(status_code=500, detail=f"FFmpeg error: {error_message}")
@@ -59,38 +77,33 @@ class Translator:
         return output_path
     
     @staticmethod
-    def get_video_info(input_path: str):
-        try:
-            probe = ffmpeg.probe(input_path)
-            video_stream = next(
-                (stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None
-            )
-            if not video_stream:
-                raise ValueError("No video stream found")
-            
-            metadata = {
-                "codec_name": video_stream.get('codec_name', 'N/A'),
-                "width": video_stream.get('width', 'N/A'),
-                "height": video_stream.get('height', 'N/A'),
-                "duration": probe['format'].get('duration', 'N/A'),
-                "bit_rate": probe['format'].get('bit_rate', 'N/A'),
-                "frame_rate": eval(video_stream.get('avg_frame_rate', '0'))
-            }
-            return metadata
-        except ffmpeg.Error as e:
-            error_message = e.stderr.decode("utf-8")
-            raise HTTPException(status_code=500, detail=f"FFmpeg error: {error_message}")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    def get_video_info(info: ProbeResult):
+        video_stream = info.video
+        if not video_stream:
+            raise HTTPException(status_code=500, detail="Error: No video stream found")
+        
+        metadata = {
+            "codec_name": video_stream.get('codec_name', 'N/A'),
+            "width": video_stream.get('width', 'N/A'),
+            "height": video_stream.get('height', 'N/A'),
+            "duration": info.format.get('duration', 'N/A'),
+            "bit_rate": info.format.get('bit_rate', 'N/A'),
+            "frame_rate": info.frame_rate
+        }
+        return metadata
     
     @staticmethod
-    def trim_video(input_path: str, output_path: str, duration: int = 20):
+    def trim_video(input_path: str, output_path: str, duration: int = 20, info: ProbeResult = None):
+        if info is not None and info.duration:
+            duration = min(duration, info.duration)
+        
         try:
-            (
+            run_ffmpeg(
                 ffmpeg
                 .input(input_path, t=duration)
                 .output(output_path, vcodec='copy', acodec='copy')
-                .run(overwrite_output=True)
+                .overwrite_output(),
+                "trim_video"
             )
         except ffmpeg.Error as e:
             error_message = e.stderr.decode("utf-8")
@@ -103,27 +116,30 @@ class Translator:
         try:
             
             # Export AAC (mono)
-            (
+            run_ffmpeg(
                 ffmpeg
                 .input(input_path)
                 .output(output_aac, acodec='aac', ac=1)
-                .run(overwrite_output=True)
+                .overwrite_output(),
+                "export_audio"
             )
             
             # Export MP3 (stereo, low bitrate)
-            (
+            run_ffmpeg(
                 ffmpeg
                 .input(input_path)
                 .output(output_mp3, acodec='libmp3lame', ac=2, audio_bitrate='128k')
-                .run(overwrite_output=True)
+                .overwrite_output(),
+                "export_audio"
             )
             
             # Export AC3
-            (
+            run_ffmpeg(
                 ffmpeg
                 .input(input_path)
                 .output(output_ac3, acodec='ac3')
-                .run(overwrite_output=True)
+                .overwrite_output(),
+                "export_audio"
             )
         
         except ffmpeg.Error as e:
@@ -149,106 +165,357 @@ class Translator:
                     }
                 )
             )
-            ffmpeg_command.run(overwrite_output=True)
+            run_ffmpeg(ffmpeg_command.overwrite_output(), "package_into_mp4")
+        except ffmpeg.Error as e:
+            error_message = e.stderr.decode("utf-8") if e.stderr else "Unknown FFmpeg error occurred"
+            raise HTTPException(status_code=500, detail=f"FFmpeg error: {error_message}")
+        return output_path
+    
+    @staticmethod
+    def bbb_fused_command(input_path: str, output_path: str, duration: float = 20, **output_args):
+        # Trim, encode the three audio tracks and mux them with the copied video in a
+        # single ffmpeg run: the input is read once and nothing intermediate hits the disk
+        source = ffmpeg.input(input_path, t=duration)
+        audio = source['a:0']
+        return ffmpeg.output(
+            source['v:0'],
+            audio,  # AAC (mono)
+            audio,  # MP3 (stereo, low bitrate)
+            audio,  # AC3
+            output_path,
+            vcodec='copy',
+            **{
+                'format': 'mp4',
+                'c:a:0': 'aac',
+                'ac:a:0': 1,
+                'c:a:1': 'libmp3lame',
+                'ac:a:1': 2,
+                'b:a:1': '128k',
+                'c:a:2': 'ac3',
+                **output_args,
+            }
+        )
+
+    @staticmethod
+    def package_bbb_fused(input_path: str, output_path: str, duration: float = 20):
+        try:
+            run_ffmpeg(Translator.bbb_fused_command(input_path, output_path, duration).overwrite_output(), "package_bbb_fused")
         except ffmpeg.Error as e:
             error_message = e.stderr.decode("utf-8") if e.stderr else "Unknown FFmpeg error occurred"
             raise HTTPException(status_code=500, detail=f"FFmpeg error: {error_message}")
+        
+        return output_path
+    
+    @staticmethod
+    def bbb_duration(info: ProbeResult = None):
+        if info is not None and not info.streams_of_type("audio"):
+            raise HTTPException(status_code=400, detail="The input has no audio track to export")
+        return min(20, info.duration) if info is not None and info.duration else 20
+
+    @staticmethod
+    def create_bbb_container(input_path: str, output_path: str, info: ProbeResult = None, fused: bool = True):
+        duration = Translator.bbb_duration(info)
+        
+        output_dir = os.path.dirname(output_path)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir, exist_ok=True)
+        
+        if fused:
+            return Translator.package_bbb_fused(input_path, output_path, duration)
+        
+        # Staged pipeline: intermediate files go to a private directory so concurrent runs do not collide
+        work_dir = tempfile.mkdtemp(prefix="bbb_")
+        trimmed_video = os.path.join(work_dir, "trimmed_bbb.mp4")
+        output_aac = os.path.join(work_dir, "output_bbb_aac.m4a")
+        output_mp3 = os.path.join(work_dir, "output_bbb_mp3.mp3")
+        output_ac3 = os.path.join(work_dir, "output_bbb_ac3.ac3")
+        
+        try:
+            Translator.trim_video(input_path, trimmed_video, info=info)
+            Translator.export_audio(trimmed_video, output_aac, output_mp3, output_ac3)
+            Translator.package_into_mp4(trimmed_video, [output_aac, output_mp3, output_ac3], output_path)
+        finally:
+            with timed("cleanup"):
+                shutil.rmtree(work_dir, ignore_errors=True)
+        
         return output_path
 
 
+    @staticmethod
+    def motion_vectors_command(input_path: str, output_path: str, **output_args):
+        return ffmpeg.input(input_path).output(
+            output_path,
+            vf="codecview=mv=1:qp=1",
+            vcodec="libx264",
+            preset="fast",
+            crf=18,
+            **output_args
+        )
+
+    @staticmethod
+    def yuv_histogram_command(input_path: str, output_path: str, **output_args):
+        return ffmpeg.input(input_path).output(
+            output_path,
+            vf="format=yuv444p,histogram",
+            vcodec="libx264",
+            preset="fast",
+            crf=18,
+            **output_args
+        )
+
+
+def remove_file(path: str):
+    with timed("cleanup"):
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+def remover(path: str):
+    def remove():
+        remove_file(path)
+    return remove
+
+
+def bbb_cost(info: ProbeResult):
+    # Video is copied, so the run costs little more than demuxing and the audio encodes
+    return estimate_cost(info, "copy", duration=Translator.bbb_duration(info))
+
+
+def bbb_container_job(params: dict, progress):
+    try:
+        with scheduler.claim(params.get("reserved", 0)):
+            info = probes.probe(params["input_path"], params["sha256"])
+            # Accepted jobs are never refused by the scheduler, only queued behind other work
+            future = scheduler.submit(
+                bbb_cost(info), Translator.create_bbb_container,
+                params["input_path"], params["output_path"], info, params.get("fused", True),
+                priority=params.get("priority", "normal"), force=True,
+            )
+        output_path = future.result()
+        record_output(output_path)
+        return {"message": "BBB container created successfully", "output_file": output_path}
+    finally:
+        remove_file(params["input_path"])
+
+
+cache = ResultCache()
+
+probes = ProbeCache()
+
+jobs = JobQueue()
+jobs.register("create_bbb_container", bbb_container_job)
+
+registry.register(Gauge(
+    "video_jobs", "Background jobs by status.",
+    lambda: [({"status": status}, count) for status, count in sorted(jobs.counts().items())],
+))
+
+
 app = FastAPI()
 
 
+@app.on_event("startup")
+def resume_jobs():
+    cache.open()
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    jobs.open()
+    # Resumed jobs hold their queue slots again, as they did when first accepted
+    scheduler.reserve(sum(params.get("reserved", 0) for params in jobs.pending()), force=True)
+    jobs.resume()
+
+
 @app.get("/")
 async def root():
     return {"message": "Welcome"}
 
 
+@app.get("/metrics")
+async def metrics():
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
+
+# Endpoints that produce a video write it to path_file/output_path when one is given;
+# without it the result is streamed back in the response as ffmpeg produces it
 @app.post("/resize/")
-async def resize(scale_factor: float = Form(...), file: UploadFile = File(...), path_file: str = Form(...)):
-    
-    file_location = f"temp_{file.filename}"
-    with open(file_location, "wb") as f:
-        f.write(await file.read())
+async def resize(
+    scale_factor: float = Form(...),
+    file: UploadFile = File(...),
+    path_file: Union[str, None] = Form(None),
+    container: str = Form("mp4"),
+    priority: str = Form("normal"),
+):
+    check_priority(priority)
+    # Downscaling encodes a fraction of the source pixels
+    factor = 1 / scale_factor ** 2 if scale_factor > 0 else 1
+
+    if path_file is None:
+        output_args = streaming_args(container)
+        upload = await save_upload(file)
+        try:
+            info = await run_in_threadpool(probes.probe, upload.path, upload.sha256)
+            cost = estimate_cost(info, "libx264", factor=factor)
+        except BaseException:
+            remove_file(upload.path)
+            raise
+        release = await scheduler.lease(cost, priority, cleanup=remover(upload.path))
+        command = Translator.resize_command(scale_factor, upload.path, "pipe:", **output_args)
+        return await stream_response(command, container, cleanup=release, stage="resize")
+
+    upload = await save_upload(file)
+    file_location = upload.path
     
     try:
         output_path = path_file
-        output_path = Translator.vid_resize(scale_factor, file_location, output_path)
+        # The output format follows the extension of the requested path
+        cache_key = ResultCache.key(
+            upload.sha256, "resize", {"scale_factor": scale_factor, "format": os.path.splitext(path_file)[1].lower()}
+        )
+        if await run_in_threadpool(cache.get, cache_key, output_path):
+            cache_status = "hit"
+        else:
+            info = await run_in_threadpool(probes.probe, file_location, upload.sha256)
+            cost = estimate_cost(info, "libx264", factor=factor)
+            output_path = await scheduler.run(
+                cost, Translator.vid_resize, scale_factor, file_location, output_path, priority=priority
+            )
+            await run_in_threadpool(cache.put, cache_key, output_path)
+            cache_status = "miss"
     finally:
-        if os.path.exists(file_location):
-            os.remove(file_location)
+        remove_file(file_location)
     
-    return {"output_file": output_path}
+    record_output(output_path)
+    return {"output_file": output_path, "cache": cache_status}
 
 
 @app.post("/modify_chroma/")
-async def modify_chroma(file: UploadFile = File(...), path_file: str = Form(...), subsampling: str = Form(...)):
-    file_location = f"temp_{file.filename}"
-    with open(file_location, "wb") as f:
-        f.write(await file.read())
+async def modify_chroma(
+    file: UploadFile = File(...),
+    path_file: Union[str, None] = Form(None),
+    subsampling: str = Form(...),
+    priority: str = Form("normal"),
+):
+    check_priority(priority)
+    upload = await save_upload(file)
+    file_location = upload.path
+
+    if path_file is None:
+        try:
+            info = await run_in_threadpool(probes.probe, file_location, upload.sha256)
+            command = Translator.chroma_command(file_location, "pipe:", subsampling, info, **streaming_args("mp4"))
+        except BaseException:
+            remove_file(file_location)
+            raise
+        release = await scheduler.lease(estimate_cost(info, "libx264"), priority, cleanup=remover(file_location))
+        return await stream_response(command, "mp4", cleanup=release, stage="modify_chroma")
     
     try:
         output_path = path_file
-        output_path = Translator.vid_modify_chroma_subsampling(file_location, output_path, subsampling)
+        cache_key = ResultCache.key(upload.sha256, "modify_chroma", {"subsampling": subsampling})
+        if await run_in_threadpool(cache.get, cache_key, output_path):
+            cache_status = "hit"
+        else:
+            info = await run_in_threadpool(probes.probe, file_location, upload.sha256)
+            output_path = await scheduler.run(
+                estimate_cost(info, "libx264"), Translator.vid_modify_chroma_subsampling,
+                file_location, output_path, subsampling, info, priority=priority,
+            )
+            await run_in_threadpool(cache.put, cache_key, output_path)
+            cache_status = "miss"
     finally:
-        if os.path.exists(file_location):
-            os.remove(file_location)
+        remove_file(file_location)
     
-    return {"output_file": output_path}
+    record_output(output_path)
+    return {"output_file": output_path, "cache": cache_status}
 
 
 @app.post("/video_info/")
 async def video_info(file: UploadFile = File(...)):
-    file_location = f"temp_{file.filename}"
-    with open(file_location, "wb") as f:
-        f.write(await file.read())
+    upload = await save_upload(file)
+    file_location = upload.path
     
     try:
-        metadata = Translator.get_video_info(file_location)
+        info = await run_in_threadpool(probes.probe, file_location, upload.sha256)
+        metadata = Translator.get_video_info(info)
     finally:
-        if os.path.exists(file_location):
-            os.remove(file_location)
+        remove_file(file_location)
     
     return metadata
 
 
 @app.post("/create_bbb_container/")
-async def create_bbb_container(file: UploadFile = File(...), path_file: str = Form(...)):
-    temp_video = f"temp_{file.filename}"
-    trimmed_video = "trimmed_bbb.mp4"
-    output_aac = "output_bbb_aac.m4a"
-    output_mp3 = "output_bbb_mp3.mp3"
-    output_ac3 = "output_bbb_ac3.ac3"
-    final_output = path_file
-    
-    output_dir = os.path.dirname(final_output)
-    if output_dir and not os.path.exists(output_dir):
-        os.makedirs(output_dir, exist_ok=True)
-    
-    with open(temp_video, "wb") as f:
-        f.write(await file.read())
+async def create_bbb_container(
+    file: UploadFile = File(...),
+    path_file: Union[str, None] = Form(None),
+    fused: bool = Form(True),
+    priority: str = Form("normal"),
+):
+    check_priority(priority)
+    upload = await save_upload(file)
+    temp_video = upload.path
+
+    # Streaming always uses the fused graph: the staged pipeline needs files between steps
+    if path_file is None:
+        try:
+            info = await run_in_threadpool(probes.probe, temp_video, upload.sha256)
+            duration = Translator.bbb_duration(info)
+            command = Translator.bbb_fused_command(temp_video, "pipe:", duration, **streaming_args("mp4"))
+        except BaseException:
+            remove_file(temp_video)
+            raise
+        release = await scheduler.lease(bbb_cost(info), priority, cleanup=remover(temp_video))
+        return await stream_response(command, "mp4", cleanup=release, stage="package_bbb_fused")
     
     try:
-        Translator.trim_video(temp_video, trimmed_video)
-        Translator.export_audio(trimmed_video, output_aac, output_mp3, output_ac3)
-        Translator.package_into_mp4(trimmed_video, [output_aac, output_mp3, output_ac3], final_output)
+        info = await run_in_threadpool(probes.probe, temp_video, upload.sha256)
+        final_output = await scheduler.run(
+            bbb_cost(info), Translator.create_bbb_container, temp_video, path_file, info, fused, priority=priority
+        )
     finally:
-        for file_path in [temp_video, trimmed_video, output_aac, output_mp3, output_ac3]:
-            if os.path.exists(file_path):
-                os.remove(file_path)
+        remove_file(temp_video)
 
+    record_output(final_output)
     return {"message": "BBB container created successfully", "output_file": final_output}
 
 
+@app.post("/jobs/create_bbb_container/", status_code=202)
+async def submit_bbb_container(
+    file: UploadFile = File(...),
+    path_file: str = Form(...),
+    fused: bool = Form(True),
+    priority: str = Form("normal"),
+):
+    check_priority(priority)
+    # The job's task is counted against the scheduler queue from now on, not only once a
+    # worker picks it up, so a burst of jobs is refused like a burst of direct requests
+    scheduler.reserve()
+    try:
+        upload = await save_upload(file, directory=JOBS_DIR)
+        job_id = jobs.submit(
+            "create_bbb_container",
+            {"input_path": upload.path, "sha256": upload.sha256, "output_path": path_file, "fused": fused, "priority": priority, "reserved": 1},
+        )
+    except BaseException:
+        scheduler.unreserve(1)
+        raise
+    return {"job_id": job_id, "status": "queued"}
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job
+
+
 @app.post("/get_tracks/")
 async def get_tracks(file: UploadFile = File(...)):
-    file_location = f"temp_{file.filename}"
-    with open(file_location, "wb") as f:
-        f.write(await file.read())
+    upload = await save_upload(file)
+    file_location = upload.path
     
     try:
-        probe = ffmpeg.probe(file_location)
-        streams = probe.get("streams", [])
+        info = await run_in_threadpool(probes.probe, file_location, upload.sha256)
+        streams = info.streams
         
         track_counts = {
             "video": 0,
@@ -266,75 +533,77 @@ async def get_tracks(file: UploadFile = File(...)):
                 track_counts["unknown"] += 1
         
         return {"track_counts": track_counts, "total_tracks": len(streams)}
-    except ffmpeg.Error as e:
-        error_message = e.stderr.decode("utf-8")
-        raise HTTPException(status_code=500, detail=f"FFmpeg erro: { error_message}")
     
     finally:
-        if os.path.exists(file_location):
-            os.remove(file_location)
+        remove_file(file_location)
 
 
 @app.post("/visualize_motion_vectors/")
-async def visualize_motion_vectors(file: UploadFile = File(...), output_path: str = Form(...)):
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{file.filename}") as temp_file:
-        temp_file_path = temp_file.name
+async def visualize_motion_vectors(
+    file: UploadFile = File(...),
+    output_path: Union[str, None] = Form(None),
+    priority: str = Form("normal"),
+):
+    check_priority(priority)
+    upload = await save_upload(file)
+    temp_file_path = upload.path
 
     try:
-        with open(temp_file_path, "wb") as f:
-            f.write(await file.read())
-        
-        (
-            ffmpeg
-            .input(temp_file_path)
-            .output(
-                output_path,
-                vf="codecview=mv=1:qp=1",
-                vcodec="libx264",
-                preset="fast",
-                crf=18
-            )
-            .run(overwrite_output=True)
-        )
+        info = await run_in_threadpool(probes.probe, temp_file_path, upload.sha256)
+        cost = estimate_cost(info, "libx264")
+    except BaseException:
+        remove_file(temp_file_path)
+        raise
+
+    if output_path is None:
+        release = await scheduler.lease(cost, priority, cleanup=remover(temp_file_path))
+        command = Translator.motion_vectors_command(temp_file_path, "pipe:", **streaming_args("mp4"))
+        return await stream_response(command, "mp4", cleanup=release, stage="motion_vectors")
+
+    try:
+        command = Translator.motion_vectors_command(temp_file_path, output_path).overwrite_output()
+        await scheduler.run(cost, run_ffmpeg, command, "motion_vectors", priority=priority)
 
     except ffmpeg.Error as e:
         error_message = e.stderr.decode("utf-8") if e.stderr else "Unknown FFmpeg error occurred"
         raise HTTPException(status_code=500, detail=f"FFmpeg error: {error_message}")
     finally:
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+        remove_file(temp_file_path)
 
+    record_output(output_path)
     return {"message": "Motion vectors visualization complete", "output_file": output_path}
 
 
 @app.post("/visualize_yuv_histogram/")
-async def visualize_yuv_histogram(file: UploadFile = File(...), output_path: str = Form(...)):
-    import tempfile
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{file.filename}") as temp_file:
-        temp_file_path = temp_file.name
+async def visualize_yuv_histogram(
+    file: UploadFile = File(...),
+    output_path: Union[str, None] = Form(None),
+    priority: str = Form("normal"),
+):
+    check_priority(priority)
+    upload = await save_upload(file)
+    temp_file_path = upload.path
 
     try:
-        with open(temp_file_path, "wb") as f:
-            f.write(await file.read())
+        info = await run_in_threadpool(probes.probe, temp_file_path, upload.sha256)
+        cost = estimate_cost(info, "libx264")
+    except BaseException:
+        remove_file(temp_file_path)
+        raise
 
-        (
-            ffmpeg
-            .input(temp_file_path)
-            .output(
-                output_path,
-                vf="format=yuv444p,histogram",
-                vcodec="libx264",
-                preset="fast",
-                crf=18
-            )
-            .run(overwrite_output=True)
-        )
+    if output_path is None:
+        release = await scheduler.lease(cost, priority, cleanup=remover(temp_file_path))
+        command = Translator.yuv_histogram_command(temp_file_path, "pipe:", **streaming_args("mp4"))
+        return await stream_response(command, "mp4", cleanup=release, stage="yuv_histogram")
+
+    try:
+        command = Translator.yuv_histogram_command(temp_file_path, output_path).overwrite_output()
+        await scheduler.run(cost, run_ffmpeg, command, "yuv_histogram", priority=priority)
     except ffmpeg.Error as e:
         error_message = e.stderr.decode("utf-8") if e.stderr else "Unknown FFmpeg error occurred"
         raise HTTPException(status_code=500, detail=f"FFmpeg error: {error_message}")
     finally:
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+        remove_file(temp_file_path)
 
+    record_output(output_path)
     return {"message": "YUV histogram visualization complete", "output_file": output_path}
\ No newline at end of file
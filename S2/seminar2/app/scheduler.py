@@ -0,0 +1,287 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import NamedTuple
+
+from fastapi import HTTPException
+
+from .metrics import Gauge, registry, stage_seconds
+
+
+SCHEDULER_CPU = float(os.environ.get("SCHEDULER_CPU", os.cpu_count() or 1))  # cores
+SCHEDULER_MEMORY = int(os.environ.get("SCHEDULER_MEMORY", 4 * 1024 ** 3))  # 4 GiB
+SCHEDULER_QUEUE_SIZE = int(os.environ.get("SCHEDULER_QUEUE_SIZE", 32))
+SCHEDULER_WORKERS = int(os.environ.get("SCHEDULER_WORKERS", 32))
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+# Pixel rate one core encodes with libx264's default preset (about 720p30 in real time)
+PIXELS_PER_CORE_SECOND = float(os.environ.get("PIXELS_PER_CORE_SECOND", 1280 * 720 * 30))
+
+# Encoder cost relative to libx264 and the frames it keeps in flight (lookahead, references)
+CODEC_COSTS = {
+    "copy": (0.02, 2),
+    "libx264": (1.0, 60),
+    "libx265": (4.0, 80),
+    "libvpx": (1.5, 30),
+    "libvpx-vp9": (3.0, 40),
+    "libaom-av1": (8.0, 70),
+}
+
+BASE_MEMORY = 64 * 1024 ** 2  # ffmpeg itself, demuxers and audio
+MIN_CORES = 0.25
+UNKNOWN_DURATION = 60.0
+
+
+class JobCost(NamedTuple):
+    cpu: float  # cores the task keeps busy
+    memory: int  # bytes
+    seconds: float  # expected wall time once started
+
+
+FREE = JobCost(0.0, 0, 0.0)
+
+
+def estimate_cost(info, codec: str = "libx264", width: int = None, height: int = None,
+                  duration: float = None, factor: float = 1.0, cores: float = None):
+    # Cost of one encode from the probed input: the pixel rate times the encoder's
+    # relative cost gives the CPU work, and the frame size times the frames the
+    # encoder buffers gives its memory. `cores` pins the parallelism (threads, segments).
+    video = (info.video if info is not None else None) or {}
+    width = int(width or video.get("width") or 1280)
+    height = int(height or video.get("height") or 720)
+    fps = (info.frame_rate if info is not None else 0) or 30.0
+    duration = duration or (info.duration if info is not None else 0) or UNKNOWN_DURATION
+    weight, frames = CODEC_COSTS.get(codec, CODEC_COSTS["libx264"])
+
+    core_seconds = width * height * fps * duration * weight * factor / PIXELS_PER_CORE_SECOND
+    cpu = max(MIN_CORES, cores or core_seconds / duration)
+    return JobCost(
+        cpu=cpu,
+        memory=BASE_MEMORY + int(width * height * 1.5 * frames),
+        seconds=core_seconds / cpu,
+    )
+
+
+def combine_costs(costs):
+    # Outputs of a single ffmpeg run share the process: their cost adds up, the time does not
+    costs = list(costs)
+    if not costs:
+        return FREE
+    return JobCost(
+        cpu=sum(cost.cpu for cost in costs),
+        memory=sum(cost.memory for cost in costs),
+        seconds=max(cost.seconds for cost in costs),
+    )
+
+
+def check_priority(priority: str):
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Unknown priority: {priority}. Choose one of {', '.join(PRIORITIES)}")
+
+
+class Task(NamedTuple):
+    sequence: int
+    cost: JobCost
+    fn: object
+    args: tuple
+    future: Future
+    submitted: float
+
+
+class Scheduler:
+    # Admission control for ffmpeg work. Tasks declare their estimated cost and start in
+    # priority order while they fit the CPU and memory budget; the rest wait in a bounded
+    # queue, and once that is full new work is refused with 429 instead of starting more
+    # encoders than the host can run. The head of the queue is never overtaken by smaller
+    # tasks behind it, so large jobs do not starve. A task larger than the whole budget
+    # runs on its own.
+    def __init__(self, cpu: float = SCHEDULER_CPU, memory: int = SCHEDULER_MEMORY,
+                 queue_size: int = SCHEDULER_QUEUE_SIZE, workers: int = SCHEDULER_WORKERS):
+        self.cpu = cpu
+        self.memory = memory
+        self.queue_size = queue_size
+        self.cpu_used = 0.0
+        self.memory_used = 0
+        self.queue = []  # heap of (priority, sequence, task)
+        self.reserved = 0  # slots held for accepted background jobs that have not queued their tasks yet
+        self.running = {}  # sequence -> (task, start time)
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def retry_after(self):
+        # Seconds until the work ahead has drained, given the whole budget
+        with self.lock:
+            return self._retry_after()
+
+    def _retry_after(self):
+        now = time.monotonic()
+        backlog = sum(task.cost.cpu * max(task.cost.seconds - (now - start), 0) for task, start in self.running.values())
+        backlog += sum(task.cost.cpu * task.cost.seconds for _, _, task in self.queue)
+        return min(max(math.ceil(backlog / self.cpu), 1), 3600)
+
+    def _check_capacity(self, count: int):
+        if len(self.queue) + self.reserved + count > self.queue_size:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many queued jobs, try again later",
+                headers={"Retry-After": str(self._retry_after())},
+            )
+
+    def check_capacity(self, count: int = 1):
+        with self.lock:
+            self._check_capacity(count)
+
+    def reserve(self, count: int = 1, force: bool = False):
+        # Background jobs wait for a worker before they submit anything, so they hold
+        # their queue slots from the moment they are accepted. `force` re-reserves the
+        # slots of jobs resumed after a restart.
+        with self.lock:
+            if not force:
+                self._check_capacity(count)
+            self.reserved += count
+
+    def unreserve(self, count: int):
+        with self.lock:
+            self.reserved -= count
+
+    @contextmanager
+    def claim(self, count: int):
+        # Hands a job's reserved slots back once the tasks submitted inside have taken
+        # their place in the queue, or the job failed before getting there
+        try:
+            yield
+        finally:
+            self.unreserve(count)
+
+    def submit_all(self, items, priority: str = "normal", force: bool = False):
+        # items are (cost, fn, args). Either all of them are queued or, when the queue
+        # cannot take them, none are. `force` skips that check for work already accepted
+        # (background jobs, including ones resumed after a restart).
+        items = list(items)
+        with self.lock:
+            if not force:
+                self._check_capacity(sum(1 for cost, _, _ in items if cost != FREE))
+
+            futures = []
+            for cost, fn, args in items:
+                # A task bigger than the budget gets all of it and runs alone
+                cost = cost._replace(cpu=min(cost.cpu, self.cpu), memory=min(cost.memory, self.memory))
+                task = Task(next(self.counter), cost, fn, args, Future(), time.monotonic())
+                if cost == FREE:
+                    # Free work (cache hits) starts at once and never waits behind encodes
+                    self._start(task)
+                else:
+                    heapq.heappush(self.queue, (PRIORITIES[priority], task.sequence, task))
+                futures.append(task.future)
+
+            self._dispatch()
+        return futures
+
+    def submit(self, cost: JobCost, fn, *args, priority: str = "normal", force: bool = False):
+        return self.submit_all([(cost, fn, args)], priority, force)[0]
+
+    async def run(self, cost: JobCost, fn, *args, priority: str = "normal", force: bool = False):
+        return await asyncio.wrap_future(self.submit(cost, fn, *args, priority=priority, force=force))
+
+    async def lease(self, cost: JobCost, priority: str = "normal", cleanup=None):
+        # Hold a share of the budget for work that runs outside the scheduler (a streamed
+        # response). Returns a callable that gives it back and then runs `cleanup`, which
+        # also runs straight away when the lease is refused.
+        try:
+            task = await asyncio.wrap_future(self.submit(cost, None, priority=priority))
+        except BaseException:
+            if cleanup:
+                cleanup()
+            raise
+
+        def release():
+            self.release(task)
+            if cleanup:
+                cleanup()
+        return release
+
+    def release(self, task: Task):
+        with self.lock:
+            self._finish(task)
+            self._dispatch()
+
+    def _fits(self, cost: JobCost):
+        return not self.running or (
+            self.cpu_used + cost.cpu <= self.cpu + 1e-9 and self.memory_used + cost.memory <= self.memory
+        )
+
+    def _dispatch(self):
+        while self.queue and self._fits(self.queue[0][2].cost):
+            _, _, task = heapq.heappop(self.queue)
+            self._start(task)
+
+    def _start(self, task: Task):
+        now = time.monotonic()
+        stage_seconds.observe(now - task.submitted, stage="queue_wait")
+        self.running[task.sequence] = (task, now)
+        self.cpu_used += task.cost.cpu
+        self.memory_used += task.cost.memory
+        if task.fn is None:
+            if not task.future.set_running_or_notify_cancel():
+                self._finish(task)
+                return
+            task.future.set_result(task)
+        else:
+            self.executor.submit(self._run, task)
+
+    def _finish(self, task: Task):
+        if self.running.pop(task.sequence, None) is not None:
+            self.cpu_used -= task.cost.cpu
+            self.memory_used -= task.cost.memory
+
+    def _run(self, task: Task):
+        try:
+            if task.future.set_running_or_notify_cancel():
+                try:
+                    result = task.fn(*task.args)
+                except BaseException as e:
+                    task.future.set_exception(e)
+                else:
+                    task.future.set_result(result)
+        finally:
+            self.release(task)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "queued": len(self.queue),
+                "reserved": self.reserved,
+                "running": len(self.running),
+                "cpu_used": round(self.cpu_used, 3),
+                "cpu_budget": self.cpu,
+                "memory_used": self.memory_used,
+                "memory_budget": self.memory,
+            }
+
+
+scheduler = Scheduler()
+
+registry.register(Gauge(
+    "video_scheduler_tasks", "Scheduler tasks waiting in the queue or running, and queue slots reserved for jobs.",
+    lambda: [
+        ({"state": "queued"}, scheduler.stats()["queued"]),
+        ({"state": "running"}, scheduler.stats()["running"]),
+        ({"state": "reserved"}, scheduler.stats()["reserved"]),
+    ],
+))
+registry.register(Gauge(
+    "video_scheduler_cpu_cores", "Estimated cores held by running tasks, and the budget.",
+    lambda: [({"kind": "used"}, scheduler.stats()["cpu_used"]), ({"kind": "budget"}, scheduler.cpu)],
+))
+registry.register(Gauge(
+    "video_scheduler_memory_bytes", "Estimated memory held by running tasks, and the budget.",
+    lambda: [({"kind": "used"}, scheduler.stats()["memory_used"]), ({"kind": "budget"}, scheduler.memory)],
+))